@@ -0,0 +1,231 @@
+import argparse
+import csv
+import json
+import os
+import time
+import bisect
+import glob
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from crypto_utils import generate_aes_key, save_key, load_key
+from stego_utils import encode_lsb, decode_lsb, trial_decode, image_size, required_pixels
+from instrumentation import Instrumentation
+from writer_utils import PROFILES
+
+logger = logging.getLogger(__name__)
+
+# ===== Manifest =====
+def read_manifest(manifest_path: str) -> list[dict]:
+    """
+    Đọc manifest job (JSONL hoặc CSV, theo đuôi file).
+    Mỗi job cần: op (encode/decode), image, key.
+    Encode: message, stego, mode (simple/advanced), pls (Simple mode), pls_format (list/seed; depth khác 1 chỉ seed),
+            profile (định dạng ảnh stego, writer_utils.PROFILES), depth (1-4 hoặc adaptive, mặc định 1);
+            file key chưa có được sinh trước (prepare_keys).
+    Decode: pls (Simple mode).
+    Identify: key là thư mục file key (*.txt); tìm các key mở được ảnh (trial_decode), pls (Simple mode).
+    Job không có id sẽ lấy số thứ tự dòng làm id.
+    """
+    if manifest_path.lower().endswith(".csv"):
+        with open(manifest_path, newline="", encoding="utf-8") as f:
+            jobs = [{k: v for k, v in row.items() if v not in (None, "")} for row in csv.DictReader(f)]
+    else:
+        with open(manifest_path, encoding="utf-8") as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+
+    for i, job in enumerate(jobs):
+        job.setdefault("id", str(i))
+        job["id"] = str(job["id"])
+    return jobs
+
+def trim_partial_line(results_path: str):
+    """Cắt dòng cuối bị ghi dở (không có newline) khi crash để lần ghi tiếp không nối vào nó."""
+    if not os.path.exists(results_path):
+        return
+    with open(results_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 4096)
+            f.seek(start)
+            block = f.read(pos - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos != end:
+            f.truncate(pos)
+
+def read_completed(results_path: str) -> set[str]:
+    """Lấy id các job đã chạy thành công từ manifest kết quả (để resume)."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Dòng cuối bị cắt dở khi crash
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result["id"]))
+    return done
+
+# ===== Kế hoạch cover (chỉ đọc header ảnh) =====
+def plan_covers(needed_pixels: list[int], cover_pixels: list[int]) -> list[int | None]:
+    """
+    Ghép mỗi payload (số pixel cần) với một cover (số pixel có), mỗi cover dùng một lần.
+    Best-fit giảm dần: payload lớn trước, chọn cover nhỏ nhất còn vừa.
+    Trả về chỉ số cover cho từng payload, None nếu không còn cover nào vừa.
+    """
+    free = sorted((pixels, i) for i, pixels in enumerate(cover_pixels))
+    plan = [None] * len(needed_pixels)
+    for j in sorted(range(len(needed_pixels)), key=lambda j: needed_pixels[j], reverse=True):
+        k = bisect.bisect_left(free, (needed_pixels[j], -1))
+        if k < len(free):
+            plan[j] = free.pop(k)[1]
+    return plan
+
+def assign_covers(jobs: list[dict], covers: list[str]) -> list[dict]:
+    """
+    Gán cover cho các job encode chưa có image, dựa trên dung lượng chính xác
+    (required_pixels) và kích thước đọc từ header; không giải mã pixel nào.
+    Job không có cover vừa được đánh dấu plan_error; file không đọc được như ảnh bị bỏ qua (cảnh báo).
+    """
+    pending = [job for job in jobs if job.get("op") == "encode" and not job.get("image")]
+    needed = [required_pixels(len(job["message"].encode()), job.get("mode", "simple"), depth=job.get("depth", 1))
+              for job in pending]
+    readable, cover_pixels = [], []
+    for cover in covers:
+        try:
+            width, height = image_size(cover)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping cover %s: %s", cover, e)
+            continue
+        readable.append(cover)
+        cover_pixels.append(width * height)
+    covers = readable
+    for job, index in zip(pending, plan_covers(needed, cover_pixels)):
+        if index is None:
+            job["plan_error"] = "No cover large enough for this payload"
+        else:
+            job["image"] = covers[index]
+    return jobs
+
+# ===== Job =====
+def run_job(job: dict) -> dict:
+    """Chạy một job encode/decode, trả về kết quả kèm thời gian."""
+    result = {"id": job["id"], "op": job.get("op")}
+    start = time.time()
+    try:
+        if "plan_error" in job:
+            raise ValueError(job["plan_error"])
+        op = job.get("op")
+        mode = job.get("mode", "simple").lower()
+        pls_path = job.get("pls") if mode == "simple" else None
+
+        if op == "encode":
+            key = load_key(job["key"])
+            metrics = Instrumentation()
+            encode_lsb(job["image"], job["message"], job["stego"], pls_path, key, mode=mode,
+                       pls_format=job.get("pls_format"), metrics=metrics,
+                       output_profile=job.get("profile"), depth=job.get("depth", 1))
+            result.update(image=job["image"], stego=job["stego"], pls=pls_path, key=job["key"],
+                          save_seconds=round(metrics.stages["save"]["seconds"], 6),
+                          bytes_written=metrics.counters["bytes_written"])
+        elif op == "identify":
+            key_files = sorted(glob.glob(os.path.join(job["key"], "*.txt")))
+            matches = trial_decode(job["image"], [load_key(path) for path in key_files], pls_path)
+            result["keys"] = [key_files[i] for i, _ in matches]
+            if matches:
+                result["message"] = matches[0][1]
+        elif op == "decode":
+            key = load_key(job["key"])
+            result["message"] = decode_lsb(job["image"], pls_path, key)
+        else:
+            raise ValueError(f"Invalid op: {op}")
+
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.time() - start, 6)
+    return result
+
+def prepare_keys(jobs: list[dict]):
+    """
+    Sinh key cho các job encode có file key chưa tồn tại, một lần cho mỗi đường dẫn,
+    trước khi chạy job (các job dùng chung đường dẫn nhận cùng một key).
+    File được ghi qua file tạm rồi đổi tên để không process nào đọc key ghi dở.
+    """
+    for path in sorted({job["key"] for job in jobs if job.get("op") == "encode" and "key" in job}):
+        if os.path.exists(path):
+            continue
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        save_key(generate_aes_key(), tmp_path)
+        os.replace(tmp_path, path)
+
+# ===== Batch =====
+def run_batch(manifest_path: str, results_path: str, workers: int = None, resume: bool = True,
+              covers: list[str] = None, profile: str = None) -> dict:
+    """
+    Chạy toàn bộ manifest trên ProcessPoolExecutor.
+    Kết quả được ghi dần (JSONL) vào results_path ngay khi mỗi job xong;
+    khi resume, dòng cuối ghi dở được cắt bỏ và các job đã thành công trong results_path được bỏ qua.
+    Kết quả encode ghi thêm save_seconds và bytes_written của ảnh stego.
+    covers: danh sách ảnh cover để gán cho các job encode không ghi image (assign_covers).
+    profile: định dạng ảnh stego mặc định cho job không ghi profile.
+    """
+    jobs = read_manifest(manifest_path)
+    if profile:
+        for job in jobs:
+            job.setdefault("profile", profile)
+    if covers:
+        assign_covers(jobs, covers)
+    if resume:
+        trim_partial_line(results_path)
+    done = read_completed(results_path) if resume else set()
+    pending = [job for job in jobs if job["id"] not in done]
+    prepare_keys(pending)
+
+    summary = {"total": len(jobs), "skipped": len(jobs) - len(pending), "ok": 0, "error": 0}
+    workers = workers or os.cpu_count() or 1
+
+    with open(results_path, "a" if resume else "w", encoding="utf-8") as out, \
+         ProcessPoolExecutor(max_workers=workers) as pool:
+        # Giới hạn số job đang chờ để manifest lớn không chiếm hết bộ nhớ
+        jobs_iter = iter(pending)
+        in_flight = set()
+        while True:
+            for job in jobs_iter:
+                in_flight.add(pool.submit(run_job, job))
+                if len(in_flight) >= workers * 4:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                summary[result["status"]] += 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch encode/decode LSB steganography")
+    parser.add_argument("manifest", help="Manifest job (.jsonl hoặc .csv)")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="Manifest kết quả (.jsonl)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Số process (mặc định: số CPU)")
+    parser.add_argument("--no-resume", action="store_true", help="Chạy lại toàn bộ, ghi đè kết quả cũ")
+    parser.add_argument("--covers", help="Thư mục cover để tự gán cho job encode không có image")
+    parser.add_argument("--profile", choices=list(PROFILES), help="Định dạng ảnh stego mặc định (lossless)")
+    args = parser.parse_args()
+
+    covers = sorted(filter(os.path.isfile, glob.glob(os.path.join(args.covers, "*")))) if args.covers else None
+    summary = run_batch(args.manifest, args.output, args.workers, resume=not args.no_resume, covers=covers,
+                        profile=args.profile)
+    print(f"Batch hoàn tất: {summary['ok']} ok, {summary['error']} lỗi, {summary['skipped']} bỏ qua "
+          f"(tổng {summary['total']}). Kết quả: {args.output}")
@@ -0,0 +1,182 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from crypto_utils import generate_aes_key, aead_encrypt, aead_decrypt
+from stego_utils import (load_image_array, encode_lsb, decode_lsb, generate_pls, generate_pls_seeded,
+                         pls_slots, embed_bits, extract_bits, bytes_to_bits, bits_to_bytes)
+from metrics_utils import compare_images
+from writer_utils import PROFILES, compare_profiles
+
+# Ma trận mặc định: ảnh trong image/ + ảnh tổng hợp (megapixel), các kích thước payload, 2 mode
+DEFAULT_SYNTHETIC_MP = [1, 12]
+DEFAULT_PAYLOADS = [1024, 64 * 1024, 512 * 1024]
+MODES = ["simple", "advanced"]
+
+def synthetic_image(megapixels: float, seed: int = 0) -> np.ndarray:
+    """Ảnh RGB ngẫu nhiên (gần vuông) với số megapixel cho trước."""
+    side = int((megapixels * 1_000_000) ** 0.5)
+    return np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+
+def measure(fn, repeat: int) -> tuple[float, object]:
+    """Thời gian tốt nhất trong repeat lần chạy; trả về (giây, kết quả lần cuối)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def peak_memory(fn) -> int:
+    """Bộ nhớ cấp phát đỉnh (byte) của một lần chạy, đo bằng tracemalloc."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_case(pixels: np.ndarray, payload_size: int, mode: str, repeat: int) -> dict:
+    """Đo từng giai đoạn cho một (ảnh, payload, mode)."""
+    height, width = pixels.shape[:2]
+    total_pixels = width * height
+    key = generate_aes_key()
+    payload = os.urandom(payload_size)
+    encrypted = aead_encrypt(payload, key)
+    needed_bits = len(encrypted) * 8
+
+    if mode == "advanced":
+        make_pls = lambda: generate_pls_seeded(total_pixels, needed_bits, key, 0)
+    else:
+        make_pls = lambda: generate_pls(total_pixels, needed_bits)
+    pls = make_pls()
+    slots = pls_slots(pls)
+    bits = bytes_to_bits(encrypted)
+    work = pixels.reshape(-1).copy()
+
+    def embed():
+        embed_bits(work, slots, bits)
+
+    stages = {
+        "pls": make_pls,
+        "aead_encrypt": lambda: aead_encrypt(payload, key),
+        "aead_decrypt": lambda: aead_decrypt(encrypted, key),
+        "embed": embed,
+        "extract": lambda: bits_to_bytes(extract_bits(work, slots)),
+    }
+    stego, pls_data = encode_lsb(pixels, payload, None, None, key, mode=mode)
+    stages["metrics"] = lambda: compare_images(pixels, stego)
+    stages["encode"] = lambda: encode_lsb(pixels, payload, None, None, key, mode=mode)
+    stages["decode"] = lambda: decode_lsb(stego, pls_data, key, as_bytes=True)
+
+    # Số byte mỗi giai đoạn thực sự xử lý (tính mb_per_s); pls không xử lý dữ liệu -> không có throughput
+    stage_bytes = {
+        "aead_encrypt": payload_size,
+        "aead_decrypt": len(encrypted),
+        "embed": len(encrypted),
+        "extract": len(encrypted),
+        "metrics": pixels.nbytes * 2,
+        "encode": payload_size,
+        "decode": payload_size,
+    }
+
+    result = {}
+    for name, fn in stages.items():
+        seconds, _ = measure(fn, repeat)
+        n_bytes = stage_bytes.get(name)
+        result[name] = {
+            "seconds": seconds,
+            "mb_per_s": n_bytes / seconds / 1e6 if n_bytes and seconds > 0 else None,
+            "peak_bytes": peak_memory(fn),
+        }
+    return result
+
+def iter_images(image_dir: str, synthetic_mp: list[float]):
+    """Sinh (tên, mảng pixel) cho ảnh trong thư mục và ảnh tổng hợp."""
+    for path in sorted(glob.glob(os.path.join(image_dir, "*"))):
+        yield os.path.basename(path), load_image_array(path)
+    for mp in synthetic_mp:
+        yield f"synthetic_{mp}MP", synthetic_image(mp)
+
+def run_benchmarks(image_dir: str, synthetic_mp: list[float], payloads: list[int], modes: list[str],
+                   repeat: int) -> dict:
+    results = {}
+    for name, pixels in iter_images(image_dir, synthetic_mp):
+        # Capacity xấp xỉ theo byte (bỏ qua overhead AES/header)
+        capacity = pixels.shape[0] * pixels.shape[1] * 3 // 8 - 1024
+        for payload_size in payloads:
+            if payload_size > capacity:
+                continue
+            for mode in modes:
+                case = f"{name}|{payload_size}B|{mode}"
+                results[case] = bench_case(pixels, payload_size, mode, repeat)
+                print(f"{case}: " + ", ".join(f"{stage}={r['seconds'] * 1000:.1f}ms"
+                                             for stage, r in results[case].items()))
+    return results
+
+def run_writer_benchmarks(image_dir: str, synthetic_mp: list[float], profiles: list[str], repeat: int) -> dict:
+    """Thời gian ghi và số byte của từng profile ảnh stego, cho từng ảnh."""
+    results = {}
+    for name, pixels in iter_images(image_dir, synthetic_mp):
+        case = f"{name}|save"
+        results[case] = compare_profiles(pixels, profiles, repeat)
+        print(f"{case}: " + ", ".join(f"{profile}={r['seconds'] * 1000:.1f}ms/{r['bytes'] / 1e6:.2f}MB"
+                                     for profile, r in results[case].items()))
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float = 0.001) -> list[str]:
+    """
+    Liệt kê các giai đoạn chậm hơn baseline quá threshold (tỉ lệ).
+    Bỏ qua chênh lệch nhỏ hơn min_seconds (nhiễu đo).
+    """
+    regressions = []
+    for case, stages in results.items():
+        for stage, r in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base and r["seconds"] > base["seconds"] * (1 + threshold) \
+                    and r["seconds"] - base["seconds"] > min_seconds:
+                regressions.append(f"{case} {stage}: {r['seconds'] * 1000:.2f}ms "
+                                   f"(baseline {base['seconds'] * 1000:.2f}ms)")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark encode/decode/PLS/AES/metrics")
+    parser.add_argument("--images", default="image", help="Thư mục ảnh cover")
+    parser.add_argument("--synthetic", type=float, nargs="*", default=DEFAULT_SYNTHETIC_MP,
+                        help="Kích thước ảnh tổng hợp (MP), ví dụ: 1 12 24 50")
+    parser.add_argument("--payloads", type=int, nargs="*", default=DEFAULT_PAYLOADS, help="Kích thước payload (byte)")
+    parser.add_argument("--modes", nargs="*", default=MODES, choices=MODES)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp, lấy lần nhanh nhất")
+    parser.add_argument("--writers", nargs="*", choices=list(PROFILES),
+                        help="Đo thêm thời gian ghi/số byte của các profile ảnh stego (không liệt kê = tất cả)")
+    parser.add_argument("--save", help="Lưu kết quả JSON (làm baseline)")
+    parser.add_argument("--baseline", help="So sánh với baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Ngưỡng chậm hơn baseline (0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="Bỏ qua chênh lệch nhỏ hơn (ms)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.images, args.synthetic, args.payloads, args.modes, args.repeat)
+    if args.writers is not None:
+        results.update(run_writer_benchmarks(args.images, args.synthetic, args.writers or None, args.repeat))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "platform": platform.platform(),
+                       "numpy": np.__version__, "results": results}, f, indent=2)
+        print(f"Đã lưu kết quả: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_ms / 1000)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("Không có regression so với baseline")
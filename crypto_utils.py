@@ -1,5 +1,12 @@
 import os
+import hashlib
+import itertools
+from functools import lru_cache, cached_property
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
 
@@ -19,13 +26,87 @@ def load_key(key_file: str) -> bytes:
         content = f.read().strip()
         return bytes.fromhex(content)
 
+# ===== Session key (dùng lại cho nhiều ảnh) =====
+class StegoKey:
+    """
+    Key đã chuẩn bị sẵn cho các lần encode/decode dùng chung một key.
+    Từ key gốc dẫn xuất (HKDF-SHA256) các subkey riêng cho header, payload và PLS;
+    seed PLS được tính một lần. encode_lsb/decode_lsb nhận StegoKey thay cho bytes.
+
+    derive=False: dùng thẳng key gốc cho mọi vai trò (định dạng cũ, chỉ để giải mã).
+    """
+
+    ROLES = ("header", "payload", "pls")
+
+    def __init__(self, key: bytes, derive: bool = True):
+        self.raw = bytes(key)
+        self.derived = derive
+        if derive:
+            subkeys = [HKDF(algorithm=hashes.SHA256(), length=len(self.raw), salt=None,
+                            info=b"stego:" + role.encode()).derive(self.raw) for role in self.ROLES]
+        else:
+            subkeys = [self.raw] * len(self.ROLES)
+        self.header_key, self.payload_key, self.pls_key = subkeys
+
+    @classmethod
+    def from_file(cls, key_file: str) -> "StegoKey":
+        return cls(load_key(key_file))
+
+    @cached_property
+    def seed(self) -> int:
+        """Seed 32-bit của PLS v1 (Advanced mode), dẫn xuất từ subkey PLS."""
+        return pls_seed(self.pls_key)
+
+    @cached_property
+    def _legacy(self) -> "StegoKey":
+        return StegoKey(self.raw, derive=False)
+
+    def subkey(self, role: str) -> bytes:
+        if role not in self.ROLES:
+            raise ValueError(f"Unknown key role: {role}")
+        return getattr(self, f"{role}_key")
+
+    def encrypt(self, data: bytes, role: str, aad: bytes = b"") -> bytes:
+        """Mã hóa AES-GCM bằng subkey của role."""
+        return aead_encrypt(data, self.subkey(role), aad)
+
+    def decrypt(self, encrypted_data: bytes, role: str, aad: bytes = b"") -> tuple[bytes, "StegoKey"]:
+        """
+        Giải mã bằng subkey của role; dữ liệu AES-CBC cũ (không có envelope) dùng key gốc.
+        Trả về (plaintext, StegoKey đã dùng) để giải mã các phần còn lại theo cùng cách.
+        """
+        key = self if is_aead(encrypted_data) or not self.derived else self._legacy
+        return decrypt_any(encrypted_data, key.subkey(role), aad), key
+
+@lru_cache(maxsize=256)
+def _stego_key(key: bytes) -> StegoKey:
+    return StegoKey(key)
+
+def as_stego_key(key) -> StegoKey:
+    """Chuẩn hóa key (bytes hoặc StegoKey) thành StegoKey; StegoKey của cùng bytes được dùng lại."""
+    return key if isinstance(key, StegoKey) else _stego_key(bytes(key))
+
+@lru_cache(maxsize=256)
+def pls_seed(key: bytes) -> int:
+    """Seed 32-bit của PLS v1 từ key: SHA-256 lấy mod 2^32."""
+    return int.from_bytes(hashlib.sha256(key).digest(), "big") % (2**32)
+
+# Cipher dựng từ key được dùng lại giữa các lần gọi (key schedule chỉ tính một lần)
+@lru_cache(maxsize=256)
+def _aes(key: bytes) -> algorithms.AES:
+    return algorithms.AES(key)
+
+@lru_cache(maxsize=256)
+def _aesgcm(key: bytes) -> AESGCM:
+    return AESGCM(key)
+
 # ===== AES Encryption/Decryption =====
 def aes_encrypt(data: bytes, key: bytes) -> bytes:
     """Mã hóa data bằng AES-CBC + PKCS7. Trả về IV + ciphertext."""
     iv = os.urandom(16)
     padder = padding.PKCS7(algorithms.AES.block_size).padder()
     padded_data = padder.update(data) + padder.finalize()
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    cipher = Cipher(_aes(key), modes.CBC(iv), backend=default_backend())
     encryptor = cipher.encryptor()
     encrypted = encryptor.update(padded_data) + encryptor.finalize()
     return iv + encrypted
@@ -34,8 +115,139 @@ def aes_decrypt(encrypted_data: bytes, key: bytes) -> bytes:
     """Giải mã AES-CBC. Input = IV + ciphertext."""
     iv = encrypted_data[:16]
     encrypted = encrypted_data[16:]
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    cipher = Cipher(_aes(key), modes.CBC(iv), backend=default_backend())
     decryptor = cipher.decryptor()
     decrypted_padded = decryptor.update(encrypted) + decryptor.finalize()
     unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
-    return unpadder.update(decrypted_padded) + unpadder.finalize()
\ No newline at end of file
+    return unpadder.update(decrypted_padded) + unpadder.finalize()
+
+# ===== AES Streaming (đọc dữ liệu CBC cũ) =====
+def aes_decrypt_stream(chunks, key: bytes):
+    """
+    Giải mã AES-CBC theo từng chunk (iterator bytes, 16 byte đầu là IV).
+    Padding chỉ được kiểm tra ở chunk cuối.
+    """
+    chunks = iter(chunks)
+    iv = b""
+    for chunk in chunks:
+        iv += chunk
+        if len(iv) >= 16:
+            break
+    if len(iv) < 16:
+        raise ValueError("Encrypted data too short")
+    iv, first = iv[:16], iv[16:]
+    cipher = Cipher(_aes(key), modes.CBC(iv), backend=default_backend())
+    decryptor = cipher.decryptor()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    if first:
+        decrypted = unpadder.update(decryptor.update(first))
+        if decrypted:
+            yield decrypted
+    for chunk in chunks:
+        decrypted = unpadder.update(decryptor.update(chunk))
+        if decrypted:
+            yield decrypted
+    yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
+
+# ===== AEAD (AES-GCM) =====
+# Envelope: MAGIC (3) + version (1) + nonce (12) + ciphertext + tag (16).
+# Sai key hoặc dữ liệu bị sửa bị phát hiện ngay khi kiểm tra tag.
+AEAD_MAGIC = b"SGA"
+AEAD_VERSION = 1
+AEAD_NONCE_SIZE = 12
+AEAD_TAG_SIZE = 16
+_AEAD_PREFIX_SIZE = len(AEAD_MAGIC) + 1 + AEAD_NONCE_SIZE
+
+def is_aead(data: bytes) -> bool:
+    """True nếu data có envelope AEAD (magic + version)."""
+    return len(data) >= len(AEAD_MAGIC) + 1 and data[:len(AEAD_MAGIC)] == AEAD_MAGIC
+
+def aead_encrypted_size(data_len: int) -> int:
+    """Kích thước output của aead_encrypt cho data_len byte."""
+    return _AEAD_PREFIX_SIZE + data_len + AEAD_TAG_SIZE
+
+def _aead_prefix(data: bytes) -> bytes:
+    """Kiểm tra magic/version, trả về nonce."""
+    if len(data) < _AEAD_PREFIX_SIZE or not is_aead(data):
+        raise ValueError("Not an AEAD envelope")
+    version = data[len(AEAD_MAGIC)]
+    if version != AEAD_VERSION:
+        raise ValueError(f"Unsupported AEAD version: {version}")
+    return data[len(AEAD_MAGIC) + 1:_AEAD_PREFIX_SIZE]
+
+def aead_encrypt(data: bytes, key: bytes, aad: bytes = b"") -> bytes:
+    """Mã hóa AES-GCM, aad được xác thực nhưng không mã hóa. Trả về envelope AEAD."""
+    nonce = os.urandom(AEAD_NONCE_SIZE)
+    return AEAD_MAGIC + bytes([AEAD_VERSION]) + nonce + _aesgcm(key).encrypt(nonce, data, aad)
+
+def aead_decrypt(encrypted_data: bytes, key: bytes, aad: bytes = b"") -> bytes:
+    """Giải mã envelope AEAD; ValueError nếu sai key, sai aad hoặc dữ liệu bị sửa."""
+    nonce = _aead_prefix(encrypted_data)
+    try:
+        return _aesgcm(key).decrypt(nonce, encrypted_data[_AEAD_PREFIX_SIZE:], aad)
+    except InvalidTag:
+        raise ValueError("Authentication failed: wrong key or corrupted data") from None
+
+def decrypt_any(encrypted_data: bytes, key: bytes, aad: bytes = b"") -> bytes:
+    """
+    Giải mã envelope AEAD, hoặc AES-CBC (định dạng cũ) nếu không có envelope.
+    Dữ liệu có envelope chỉ được giải mã bằng AES-GCM: sai tag luôn là lỗi, không thử lại CBC.
+    """
+    if is_aead(encrypted_data):
+        return aead_decrypt(encrypted_data, key, aad)
+    return aes_decrypt(encrypted_data, key)
+
+def aead_encrypt_stream(chunks, key: bytes, aad: bytes = b""):
+    """Mã hóa AES-GCM theo từng chunk; kết quả nối lại giống aead_encrypt."""
+    nonce = os.urandom(AEAD_NONCE_SIZE)
+    encryptor = Cipher(_aes(key), modes.GCM(nonce), backend=default_backend()).encryptor()
+    encryptor.authenticate_additional_data(aad)
+    yield AEAD_MAGIC + bytes([AEAD_VERSION]) + nonce
+    for chunk in chunks:
+        encrypted = encryptor.update(chunk)
+        if encrypted:
+            yield encrypted
+    yield encryptor.finalize() + encryptor.tag
+
+def aead_decrypt_stream(chunks, key: bytes, aad: bytes = b""):
+    """
+    Giải mã envelope AEAD theo từng chunk. Tag chỉ được kiểm tra ở cuối:
+    plaintext đã trả ra chỉ đáng tin khi generator kết thúc không lỗi.
+    """
+    chunks = iter(chunks)
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) >= _AEAD_PREFIX_SIZE:
+            break
+    nonce = _aead_prefix(buf)
+    decryptor = Cipher(_aes(key), modes.GCM(nonce), backend=default_backend()).decryptor()
+    decryptor.authenticate_additional_data(aad)
+    # Giữ lại AEAD_TAG_SIZE byte cuối làm tag
+    tail = buf[_AEAD_PREFIX_SIZE:]
+    for chunk in itertools.chain([b""], chunks):
+        tail += chunk
+        if len(tail) > AEAD_TAG_SIZE:
+            decrypted = decryptor.update(tail[:-AEAD_TAG_SIZE])
+            tail = tail[-AEAD_TAG_SIZE:]
+            if decrypted:
+                yield decrypted
+    if len(tail) != AEAD_TAG_SIZE:
+        raise ValueError("Encrypted data too short")
+    try:
+        yield decryptor.finalize_with_tag(tail)
+    except InvalidTag:
+        raise ValueError("Authentication failed: wrong key or corrupted data") from None
+
+def decrypt_stream_any(chunks, key: bytes, aad: bytes = b""):
+    """Giải mã theo chunk, tự nhận envelope AEAD hoặc AES-CBC (định dạng cũ)."""
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(AEAD_MAGIC) + 1:
+            break
+    chunks = itertools.chain([head], chunks)
+    if is_aead(head):
+        return aead_decrypt_stream(chunks, key, aad)
+    return aes_decrypt_stream(chunks, key)
@@ -0,0 +1,166 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from stego_utils import load_image_array
+from metrics_utils import to_gray
+
+# Giới hạn bộ nhớ mặc định cho cache (byte), chỉnh qua biến môi trường STEGO_IMAGE_CACHE_MB
+DEFAULT_CACHE_BYTES = int(os.environ.get("STEGO_IMAGE_CACHE_MB", 512)) * 1024 * 1024
+
+# Giới hạn số entry (kể cả entry chỉ mới đọc size, chưa có mảng) và số hash đường dẫn được nhớ
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_PATH_DIGESTS = 4096
+
+class CachedImage:
+    """
+    Một ảnh đã tải, khóa theo hash nội dung. Các giá trị được tính lười và dùng lại:
+    size (chỉ đọc header), rgb (giải mã một lần), gray, gray_hist.
+    Mảng trả về là read-only vì được chia sẻ giữa các request.
+    """
+
+    def __init__(self, digest: str, source, cache: "ImageCache"):
+        self.digest = digest
+        self._source = source
+        self._cache = cache
+        self._size = None
+        self._rgb = None
+        self._gray = None
+        self._gray_hist = None
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """(width, height); với file chưa giải mã chỉ đọc header ảnh."""
+        if self._size is None:
+            if self._rgb is not None or not isinstance(self._source, (str, os.PathLike)):
+                height, width = self.rgb.shape[:2]
+                self._size = (width, height)
+            else:
+                with Image.open(self._source) as im:
+                    self._size = im.size
+        return self._size
+
+    @property
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            rgb = np.array(load_image_array(self._source))
+            rgb.setflags(write=False)
+            self._rgb = rgb
+            self._cache._account(self)
+        return self._rgb
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            gray = to_gray(self.rgb)
+            gray.setflags(write=False)
+            self._gray = gray
+            self._cache._account(self)
+        return self._gray
+
+    @property
+    def gray_hist(self) -> np.ndarray:
+        if self._gray_hist is None:
+            hist = np.bincount(self.gray.ravel(), minlength=256)
+            hist.setflags(write=False)
+            self._gray_hist = hist
+        return self._gray_hist
+
+    def load(self, *fields: str) -> "CachedImage":
+        """
+        Tính trước các giá trị lười (vd "size", "rgb", "gray_hist") trong một lần gọi,
+        để handler async chạy phần I/O/giải mã này ngoài event loop. Trả về chính entry.
+        """
+        for name in fields:
+            if name not in ("size", "rgb", "gray", "gray_hist"):
+                raise ValueError(f"Invalid cached image field: {name}")
+            getattr(self, name)
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self._rgb, self._gray, self._gray_hist) if a is not None)
+
+class ImageCache:
+    """
+    LRU cache các ảnh đã giải mã, khóa theo SHA-256 nội dung file.
+    Tổng bộ nhớ của các mảng được giới hạn bởi max_bytes, số entry bởi max_entries;
+    vượt quá thì bỏ ảnh ít dùng nhất.
+    Hash của đường dẫn được nhớ theo (mtime, kích thước) để không phải đọc lại file
+    (LRU, tối đa max_path_digests đường dẫn).
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_path_digests: int = DEFAULT_MAX_PATH_DIGESTS):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_path_digests = max_path_digests
+        self._entries = OrderedDict()
+        self._path_digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, source) -> str:
+        if isinstance(source, (str, os.PathLike)):
+            stat = os.stat(source)
+            memo_key = (os.fspath(source), stat.st_mtime_ns, stat.st_size)
+            with self._lock:
+                digest = self._path_digests.get(memo_key)
+                if digest is not None:
+                    self._path_digests.move_to_end(memo_key)
+                    return digest
+            h = hashlib.sha256()
+            with open(source, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                self._path_digests[memo_key] = digest
+                while len(self._path_digests) > self.max_path_digests:
+                    self._path_digests.popitem(last=False)
+            return digest
+        if isinstance(source, np.ndarray):
+            h = hashlib.sha256(str(source.shape).encode())
+            h.update(np.ascontiguousarray(source).data)
+            return h.hexdigest()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(source).hexdigest()
+        raise TypeError(f"Unsupported image source for cache: {type(source).__name__}")
+
+    def get(self, source) -> CachedImage:
+        """Lấy (hoặc tạo) entry cho ảnh; source: đường dẫn, bytes hoặc mảng NumPy."""
+        digest = self._digest(source)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = CachedImage(digest, source, self)
+            self._entries[digest] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _account(self, entry: CachedImage):
+        """Gọi khi entry vừa tính thêm mảng: bỏ bớt entry cũ nếu vượt giới hạn."""
+        with self._lock:
+            total = sum(e.nbytes for e in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                digest, oldest = next(iter(self._entries.items()))
+                if oldest is entry:
+                    self._entries.move_to_end(digest)
+                    digest, oldest = next(iter(self._entries.items()))
+                del self._entries[digest]
+                total -= oldest.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._path_digests.clear()
+
+image_cache = ImageCache()
@@ -0,0 +1,67 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+class Instrumentation:
+    """
+    Thu thập số liệu cho encode/decode: thời gian từng giai đoạn, số đếm (byte/bit/pixel)
+    và bộ nhớ cấp phát đỉnh của từng giai đoạn (track_memory=True, dùng tracemalloc).
+
+    callback(kind, name, value) được gọi mỗi khi có số liệu mới:
+        kind="stage": value = {"seconds": ..., "peak_bytes": ... (nếu track_memory)}
+        kind="count": value = số đếm được cộng thêm
+    Dùng callback để đẩy số liệu sang hệ thống metrics bên ngoài.
+    """
+
+    def __init__(self, callback=None, track_memory: bool = False):
+        self.callback = callback
+        self.track_memory = track_memory
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Đo một giai đoạn; gọi lại cùng tên sẽ cộng dồn thời gian."""
+        started_tracing = False
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"seconds": time.perf_counter() - start}
+            if self.track_memory:
+                record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            total = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += record["seconds"]
+            total["calls"] += 1
+            if "peak_bytes" in record:
+                total["peak_bytes"] = max(total.get("peak_bytes", 0), record["peak_bytes"])
+            if self.callback:
+                self.callback("stage", name, record)
+
+    def count(self, name: str, value: int):
+        """Cộng dồn một số đếm (ví dụ payload_bytes, bits, pixels)."""
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.callback:
+            self.callback("count", name, value)
+
+    def as_dict(self) -> dict:
+        return {"stages": self.stages, "counters": self.counters}
+
+class NullInstrumentation:
+    """Instrumentation rỗng (mặc định) để hot path không tốn chi phí đo."""
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def count(self, name: str, value: int):
+        pass
+
+NULL_INSTRUMENTATION = NullInstrumentation()
@@ -2,219 +2,226 @@ import gradio as gr
 import tempfile
 import time
 import os
-import shutil
+import logging
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from crypto_utils import generate_aes_key, save_key, load_key
-from stego_utils import encode_lsb, decode_lsb
-from PIL import Image
+from stego_utils import encode_lsb, decode_lsb, max_payload_size, capacity, ADAPTIVE
+from image_cache import image_cache
+from metrics_utils import compare_images
 import matplotlib.pyplot as plt
 import numpy as np
 
 # ===== Calculate Max Message Size =====
-def calculate_max_message(image_file, mode):
+def calculate_max_message(image_file, mode, depth="1"):
     if not image_file:
         return "Vui lòng tải ảnh để xem giới hạn"
     
     try:
-        with Image.open(image_file) as im:
-            width, height = im.size
-            total_pixels = width * height
-            
-            # Tính overhead cho AES (IV + padding)
-            aes_overhead = 16 + 16  # IV (16 bytes) + max padding (16 bytes)
-            
-            if mode == "advanced":
-                # Advanced mode: cần trừ metadata header
-                # Metadata format: "advanced:XXXX" (khoảng 20 bytes)
-                # + AES overhead cho metadata
-                metadata_size = 20 + aes_overhead
-                metadata_bits = 16 + metadata_size * 8  # LENGTH_BITS + encrypted metadata
-                header_pixels = (metadata_bits + 2) // 3
-                
-                available_pixels = total_pixels - header_pixels
-                max_bits = available_pixels * 3
-            else:
-                # Simple mode: dùng toàn bộ ảnh
-                max_bits = total_pixels * 3
-            
-            # Trừ overhead của AES
-            max_bytes = (max_bits // 8) - aes_overhead
-            max_kb = max_bytes / 1024
-            max_chars = max_bytes  # Ước lượng (1 byte = 1 char cho ASCII)
-            
-            return f"📊 {width}x{height} | Tối đa: ~{max_chars:,} ký tự (~{max_kb:.1f} KB)"
+        # Kích thước lấy từ cache (chỉ đọc header ảnh lần đầu); capacity tính chính xác
+        # theo header, overhead AES-GCM, mode và depth như encode_lsb
+        entry = image_cache.get(image_file)
+        width, height = entry.size
+        if depth == ADAPTIVE:
+            # Adaptive phụ thuộc texture -> cần pixel (ảnh gốc đã cache)
+            max_bytes = capacity(entry.rgb, mode, depth=ADAPTIVE)
+        else:
+            max_bytes = max_payload_size(width, height, mode, depth=depth)
+        max_kb = max_bytes / 1024
+        max_chars = max_bytes  # 1 byte = 1 ký tự ASCII (UTF-8 có dấu tốn 2-3 byte)
+        
+        return f"📊 {width}x{height} | Tối đa: ~{max_chars:,} ký tự (~{max_kb:.1f} KB)"
     
     except Exception as e:
         return f"❌ Lỗi: {str(e)}"
 
+# ===== Job Queue =====
+# Các bước nặng (encode/decode/vẽ histogram) chạy trong process pool dùng chung;
+# handler Gradio là async nên chỉ chờ kết quả, không chiếm thread của server.
+MAX_WORKERS = int(os.environ.get("STEGO_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+QUEUE_SIZE = int(os.environ.get("STEGO_QUEUE_SIZE", 64))
+_pool = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    return _pool
+
+def _timed_call(fn, *args, **kwargs):
+    """Chạy fn trong worker, trả về (kết quả, thời gian chạy thực)."""
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - start
+
+async def run_job(fn, *args, **kwargs):
+    """
+    Gửi fn vào process pool và chờ kết quả (kèm thời gian chạy).
+    Khi người dùng hủy request, job chưa bắt đầu cũng bị hủy khỏi pool.
+    """
+    future = get_pool().submit(_timed_call, fn, *args, **kwargs)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+
+async def run_local(fn, *args, **kwargs):
+    """
+    Chạy fn trên thread (asyncio.to_thread) để không chặn event loop.
+    Dùng cho việc đọc cache ảnh và tính metrics: dùng chung cache trong process,
+    không phải copy mảng pixel sang process worker.
+    """
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+def plot_histograms(curves, title, figsize) -> str:
+    """Vẽ các đường histogram (hist, style) ra file PNG tạm, trả về đường dẫn."""
+    x = np.arange(256)
+    fig, ax = plt.subplots(figsize=figsize)
+    for hist, style in curves:
+        ax.plot(x, hist, **style)
+    ax.set_title(title)
+    ax.set_xlabel("Giá trị Pixel")
+    ax.set_ylabel("Số lượng")
+    ax.set_xlim(0,255)
+    ax.legend()
+    temp_plot = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    plt.savefig(temp_plot.name, dpi=150, bbox_inches="tight")
+    plt.close()
+    return temp_plot.name
+
 # ===== Encode & Decode =====
-def auto_encode_decode(image_file, message, mode):
+async def auto_encode_decode(image_file, message, mode, depth="1", progress=gr.Progress()):
     if not image_file or not message:
         gr.Warning("⚠️ Vui lòng cung cấp ảnh và tin nhắn")
         return None, None, None, None, None, None, None
     
     try:
+        progress(0, desc="Đang đọc ảnh...")
         key = generate_aes_key()
         timestamp = int(time.time())
         stego_filename = f"stego_image_{mode}_{timestamp}.png"
         pls_filename = f"pls_metadata_{mode}_{timestamp}.enc" if mode=="simple" else None
         key_filename = f"aes_key_{mode}_{timestamp}.txt"
+
+        # Ghi thẳng file kết quả vào thư mục tạm để tải về
+        out_dir = tempfile.mkdtemp()
+        stego_path = os.path.join(out_dir, stego_filename)
+        key_path = os.path.join(out_dir, key_filename)
+        pls_path = os.path.join(out_dir, pls_filename) if mode=="simple" else None
+        save_key(key, key_path)
+
+        # Ảnh gốc giải mã một lần (cache theo nội dung), dùng chung cho encode và metrics
+        orig_entry = await run_local(image_cache.get, image_file)
+
+        # Kiểm tra dung lượng trước khi giải mã pixel (adaptive cần pixel để tính texture)
+        await run_local(orig_entry.load, "size")
+        width, height = orig_entry.size
+        if depth == ADAPTIVE:
+            await run_local(orig_entry.load, "rgb")
+            max_bytes = await run_local(capacity, orig_entry.rgb, mode, depth=ADAPTIVE)
+        else:
+            max_bytes = max_payload_size(width, height, mode, depth=depth)
+        if len(message.encode()) > max_bytes:
+            gr.Warning(f"⚠️ Tin nhắn quá dài: tối đa {max_bytes:,} byte cho ảnh {width}x{height}")
+            return None, None, None, None, None, None, None
+        await run_local(orig_entry.load, "rgb", "gray_hist")
+        orig_rgb = orig_entry.rgb
+
+        # Encode
+        progress(0.2, desc="Đang mã hóa...")
+        (stego_rgb, _), enc_time = await run_job(encode_lsb, orig_rgb, message, stego_path, pls_path, key, mode=mode, depth=depth)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img, \
-             tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_stego, \
-             tempfile.NamedTemporaryFile(delete=False, suffix=".enc") as tmp_pls, \
-             tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp_key:
-
-            with open(image_file, "rb") as f:
-                tmp_img.write(f.read())
-            tmp_img.flush()
-            save_key(key, tmp_key.name)
-            tmp_key.flush()
-
-            # Encode
-            start_enc = time.time()
-            encode_lsb(tmp_img.name, message, tmp_stego.name, tmp_pls.name if mode=="simple" else None, key, mode=mode)
-            enc_time = time.time() - start_enc
-            
-            # Metrics
-            orig = np.array(Image.open(tmp_img.name).convert("RGB"), dtype=np.float64)
-            stego = np.array(Image.open(tmp_stego.name).convert("RGB"), dtype=np.float64)
-            mse = np.mean((orig - stego)**2)
-            psnr = float("inf") if mse==0 else 20*np.log10(255.0/np.sqrt(mse))
-
-            # Histogram
-            orig_gray = np.array(Image.open(tmp_img.name).convert("L"))
-            stego_gray = np.array(Image.open(tmp_stego.name).convert("L"))
-            orig_hist, _ = np.histogram(orig_gray.flatten(), bins=256, range=(0,255))
-            stego_hist, _ = np.histogram(stego_gray.flatten(), bins=256, range=(0,255))
-            x = np.arange(256)
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.plot(x, orig_hist, label="Ảnh gốc", color="blue", linewidth=1.5)
-            ax.plot(x, stego_hist, label="Ảnh đã mã hóa", color="orange", linestyle="--", linewidth=1.5)
-            ax.set_title(f"So sánh Histogram - Phương pháp: {mode.capitalize()}")
-            ax.set_xlabel("Giá trị Pixel")
-            ax.set_ylabel("Số lượng")
-            ax.set_xlim(0,255)
-            ax.legend()
-            temp_plot = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            plt.savefig(temp_plot.name, dpi=150, bbox_inches="tight")
-            plt.close()
-
-            tmp_img.close()
-            tmp_stego.close()
-            if mode=="simple": tmp_pls.close()
-            tmp_key.close()
-
-            # Copy ra thư mục tạm
-            stego_dir = tempfile.mkdtemp()
-            stego_path = os.path.join(stego_dir, stego_filename)
-            shutil.copy(tmp_stego.name, stego_path)
-
-            key_dir = tempfile.mkdtemp()
-            key_path = os.path.join(key_dir, key_filename)
-            shutil.copy(tmp_key.name, key_path)
-
-            pls_path = None
-            if mode=="simple":
-                pls_dir = tempfile.mkdtemp()
-                pls_path = os.path.join(pls_dir, pls_filename)
-                shutil.copy(tmp_pls.name, pls_path)
-
-            metrics_text = f"MSE: {mse:.6f} | PSNR: {psnr:.2f} dB"
-            time_text = f"⏱️ Thời gian mã hóa: {enc_time:.3f}s"
-
-            return (stego_path, pls_path, key_path,
-                    time_text, temp_plot.name, metrics_text, metrics_text)
+        # Metrics
+        progress(0.7, desc="Đang đánh giá chất lượng...")
+        metrics = await run_local(compare_images, orig_rgb, stego_rgb)
+        mse, psnr = metrics["mse"], metrics["psnr"]
+
+        # Histogram (đã tính cùng lượt với MSE/PSNR)
+        curves = [
+            (orig_entry.gray_hist, dict(label="Ảnh gốc", color="blue", linewidth=1.5)),
+            (metrics["gray_hist_stego"], dict(label="Ảnh đã mã hóa", color="orange", linestyle="--", linewidth=1.5)),
+        ]
+        plot_path, _ = await run_job(plot_histograms, curves, f"So sánh Histogram - Phương pháp: {mode.capitalize()}", (10,4))
+
+        metrics_text = f"MSE: {mse:.6f} | PSNR: {psnr:.2f} dB"
+        time_text = f"⏱️ Thời gian mã hóa: {enc_time:.3f}s"
+
+        return (stego_path, pls_path, key_path,
+                time_text, plot_path, metrics_text, metrics_text)
 
     except Exception as e:
         gr.Error(f"❌ Lỗi: {str(e)}")
         return None, None, None, None, None, None, None
 
 # ===== Decode Message =====
-def decode_message(stego_file, pls_file, key_file, mode):
+async def decode_message(stego_file, pls_file, key_file, mode, progress=gr.Progress()):
     if not stego_file or not key_file:
         gr.Warning("⚠️ Cần ảnh stego và khóa AES")
         return None, None
+    if mode == "simple" and not pls_file:
+        gr.Warning("⚠️ Simple mode cần file PLS (.enc)")
+        return None, None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_stego, \
-             tempfile.NamedTemporaryFile(delete=False, suffix=".enc") as tmp_pls, \
-             tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp_key:
-
-            with open(stego_file, "rb") as f: tmp_stego.write(f.read())
-            if mode=="simple" and pls_file:
-                with open(pls_file, "rb") as f: tmp_pls.write(f.read())
-            with open(key_file, "r") as f: tmp_key.write(f.read().encode())
-
-            tmp_stego.flush()
-            tmp_pls.flush()
-            tmp_key.flush()
-
-            key = load_key(tmp_key.name)
-            pls_path = tmp_pls.name if mode=="simple" else None
-            
-            start_dec = time.time()
-            decoded_message = decode_lsb(tmp_stego.name, pls_path, key)
-            dec_time = time.time() - start_dec
-            
-            time_text = f"⏱️ Thời gian giải mã: {dec_time:.3f}s"
-            
-            return decoded_message, time_text
+        key = load_key(key_file)
+        pls_path = pls_file if mode=="simple" else None
+        
+        progress(0, desc="Đang giải mã...")
+        decoded_message, dec_time = await run_job(decode_lsb, stego_file, pls_path, key)
+        
+        time_text = f"⏱️ Thời gian giải mã: {dec_time:.3f}s"
+        
+        return decoded_message, time_text
     except Exception as e:
         gr.Error(f"❌ Lỗi khi giải mã: {str(e)}")
         return None, None
 
 # ===== Run Tests cho 2 phương pháp =====
-def run_tests(image_file, message):
+async def run_tests(image_file, message, progress=gr.Progress()):
     if not image_file or not message:
         gr.Warning("⚠️ Vui lòng cung cấp ảnh và tin nhắn")
         return None, "Không có kết quả", None
     
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
-            with open(image_file, "rb") as f:
-                tmp_img.write(f.read())
-            tmp_img.flush()
+        # Ảnh gốc giải mã một lần (cache theo nội dung), cả 2 phương pháp dùng chung
+        progress(0, desc="Đang đọc ảnh...")
+        orig_entry = await run_local(image_cache.get, image_file)
+        await run_local(orig_entry.load, "rgb", "gray_hist")
+        orig_rgb = orig_entry.rgb
+        height, width = orig_rgb.shape[:2]
 
         results = []
         methods = ["simple", "advanced"]
         stego_images = []
+        stego_hists = []
 
-        for method in methods:
+        for i, method in enumerate(methods):
             key = generate_aes_key()
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_stego, \
-                 tempfile.NamedTemporaryFile(delete=False, suffix=".enc") as tmp_pls:
-                
-                # Resolution
-                with Image.open(tmp_img.name) as im:
-                    width, height = im.size
-                
-                # Encode
-                start = time.time()
-                encode_lsb(tmp_img.name, message, tmp_stego.name, tmp_pls.name if method=="simple" else None, key, mode=method)
-                enc_time = time.time() - start
-                
-                # Decode
-                start = time.time()
-                decoded = decode_lsb(tmp_stego.name, tmp_pls.name if method=="simple" else None, key)
-                dec_time = time.time() - start
-                
-                # Metrics
-                orig = np.array(Image.open(tmp_img.name).convert("RGB"), dtype=np.float64)
-                stego = np.array(Image.open(tmp_stego.name).convert("RGB"), dtype=np.float64)
-                mse = np.mean((orig - stego)**2)
-                psnr = float("inf") if mse==0 else 20*np.log10(255.0/np.sqrt(mse))
-                
-                stego_images.append(tmp_stego.name)
-                
-                results.append({
-                    "method": method.capitalize(),
-                    "resolution": f"{width}x{height}",
-                    "mse": f"{mse:.6f}",
-                    "psnr": f"{psnr:.2f} dB",
-                    "encode_time": f"{enc_time:.3f}s",
-                    "decode_time": f"{dec_time:.3f}s",
-                    "decoded": decoded[:100]+"..." if len(decoded)>100 else decoded
-                })
+            # Encode (trong bộ nhớ, PLS giữ dạng bytes)
+            progress((2*i + 1) / 5, desc=f"{method.capitalize()}: đang mã hóa...")
+            (stego_rgb, pls_data), enc_time = await run_job(encode_lsb, orig_rgb, message, None, None, key, mode=method)
+            
+            # Decode
+            progress((2*i + 2) / 5, desc=f"{method.capitalize()}: đang giải mã...")
+            decoded, dec_time = await run_job(decode_lsb, stego_rgb, pls_data, key)
+            
+            # Metrics
+            metrics = await run_local(compare_images, orig_rgb, stego_rgb)
+            mse, psnr = metrics["mse"], metrics["psnr"]
+            
+            stego_images.append(stego_rgb)
+            stego_hists.append(metrics["gray_hist_stego"])
+            
+            results.append({
+                "method": method.capitalize(),
+                "resolution": f"{width}x{height}",
+                "mse": f"{mse:.6f}",
+                "psnr": f"{psnr:.2f} dB",
+                "encode_time": f"{enc_time:.3f}s",
+                "decode_time": f"{dec_time:.3f}s",
+                "decoded": decoded[:100]+"..." if len(decoded)>100 else decoded
+            })
         
         # Markdown table
         table = "\n\n### 📊 Bảng So Sánh Chi Tiết\n\n"
@@ -224,30 +231,16 @@ def run_tests(image_file, message):
             table += f"| {res['method']} | {res['resolution']} | {res['mse']} | {res['psnr']} | {res['encode_time']} | {res['decode_time']} | {res['decoded']} |\n"
         
         # Histogram comparison
-        orig_gray = np.array(Image.open(tmp_img.name).convert("L"))
-        simple_gray = np.array(Image.open(stego_images[0]).convert("L"))
-        advanced_gray = np.array(Image.open(stego_images[1]).convert("L"))
-        
-        orig_hist, _ = np.histogram(orig_gray.flatten(), bins=256, range=(0,255))
-        simple_hist, _ = np.histogram(simple_gray.flatten(), bins=256, range=(0,255))
-        advanced_hist, _ = np.histogram(advanced_gray.flatten(), bins=256, range=(0,255))
-        
-        x = np.arange(256)
-        fig, ax = plt.subplots(figsize=(12,5))
-        ax.plot(x, orig_hist, label="Ảnh gốc", color="blue", linewidth=2)
-        ax.plot(x, simple_hist, label="Simple (Random PLS)", color="green", linestyle="--", linewidth=1.5)
-        ax.plot(x, advanced_hist, label="Advanced (Seeded PLS + Metadata)", color="red", linestyle=":", linewidth=1.5)
-        ax.set_title("So sánh Histogram - Cả 2 Phương Pháp")
-        ax.set_xlabel("Giá trị Pixel")
-        ax.set_ylabel("Số lượng")
-        ax.set_xlim(0,255)
-        ax.legend()
-        temp_plot = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-        plt.savefig(temp_plot.name, dpi=150, bbox_inches="tight")
-        plt.close()
+        progress(0.9, desc="Đang vẽ histogram...")
+        curves = [
+            (orig_entry.gray_hist, dict(label="Ảnh gốc", color="blue", linewidth=2)),
+            (stego_hists[0], dict(label="Simple (Random PLS)", color="green", linestyle="--", linewidth=1.5)),
+            (stego_hists[1], dict(label="Advanced (Seeded PLS + Metadata)", color="red", linestyle=":", linewidth=1.5)),
+        ]
+        plot_path, _ = await run_job(plot_histograms, curves, "So sánh Histogram - Cả 2 Phương Pháp", (12,5))
         
         gr.Info("✅ So sánh hoàn tất!")
-        return stego_images, table, temp_plot.name
+        return stego_images, table, plot_path
 
     except Exception as e:
         gr.Error(f"❌ Lỗi khi chạy so sánh: {str(e)}")
@@ -265,6 +258,7 @@ def create_interface():
                 gr.Markdown("### Tải ảnh và mã hóa tin nhắn bí mật")
                 with gr.Row():
                     mode_dropdown = gr.Dropdown(choices=["simple","advanced"], label="🔧 Phương Pháp Giấu Tin", value="simple")
+                    depth_dropdown = gr.Dropdown(choices=["1","2","3","4",ADAPTIVE], label="🎚️ Số Bit Mỗi Kênh", value="1")
                 with gr.Row():
                     with gr.Column():
                         image_input = gr.Image(label="📷 Ảnh Gốc", type="filepath", height=430)
@@ -273,6 +267,7 @@ def create_interface():
                         max_msg_info = gr.Textbox(label="📏 Kích thước tin nhắn tối đa", interactive=False, value="Vui lòng tải ảnh để xem giới hạn")
                 with gr.Row():
                     encode_btn = gr.Button("🚀 Mã Hóa", variant="primary", size="lg")
+                    encode_cancel_btn = gr.Button("⛔ Hủy", variant="stop", size="lg")
                 with gr.Row():
                     with gr.Column():
                         stego_output = gr.Image(label="🖼️ Ảnh Stego", type="filepath", height=400)
@@ -291,17 +286,21 @@ def create_interface():
                 mode_dropdown.change(toggle_pls, mode_dropdown, pls_output)
                 
                 # Update max message size when image or mode changes
-                def update_max_info(img, mode):
-                    return calculate_max_message(img, mode)
+                def update_max_info(img, mode, depth):
+                    return calculate_max_message(img, mode, depth)
                 
-                image_input.change(update_max_info, [image_input, mode_dropdown], max_msg_info)
-                mode_dropdown.change(update_max_info, [image_input, mode_dropdown], max_msg_info)
+                image_input.change(update_max_info, [image_input, mode_dropdown, depth_dropdown], max_msg_info)
+                mode_dropdown.change(update_max_info, [image_input, mode_dropdown, depth_dropdown], max_msg_info)
+                depth_dropdown.change(update_max_info, [image_input, mode_dropdown, depth_dropdown], max_msg_info)
 
-                encode_btn.click(
+                encode_event = encode_btn.click(
                     fn=auto_encode_decode,
-                    inputs=[image_input, message_input, mode_dropdown],
-                    outputs=[stego_output, pls_output, key_output, encode_time, hist_output, metrics_output, metrics_output]
+                    inputs=[image_input, message_input, mode_dropdown, depth_dropdown],
+                    outputs=[stego_output, pls_output, key_output, encode_time, hist_output, metrics_output, metrics_output],
+                    concurrency_limit=MAX_WORKERS,
+                    concurrency_id="encode"
                 )
+                encode_cancel_btn.click(fn=None, inputs=None, outputs=None, cancels=[encode_event])
 
             # --- Giải Mã ---
             with gr.Tab("🔓 Giải Mã Tin Nhắn"):
@@ -327,7 +326,9 @@ def create_interface():
                 decode_btn.click(
                     fn=decode_message,
                     inputs=[decode_image, decode_pls_file, decode_key_file, decode_mode],
-                    outputs=[decoded_message_output, decode_time_output]
+                    outputs=[decoded_message_output, decode_time_output],
+                    concurrency_limit=MAX_WORKERS,
+                    concurrency_id="decode"
                 )
 
             # --- So Sánh ---
@@ -338,6 +339,7 @@ def create_interface():
                     test_message_input = gr.Textbox(label="💬 Tin Nhắn Kiểm Tra", lines=10, placeholder="Nhập tin nhắn để thử nghiệm...")
                 with gr.Row():
                     test_btn = gr.Button("🧪 So Sánh", variant="primary", size="lg")
+                    test_cancel_btn = gr.Button("⛔ Hủy", variant="stop", size="lg")
                 with gr.Row():
                     test_gallery = gr.Gallery(label="🖼️ Ảnh Stego [Simple, Advanced]", columns=2, height=350)
                 with gr.Row():
@@ -345,11 +347,15 @@ def create_interface():
                 with gr.Row():
                     test_histogram = gr.Image(label="📊 Biểu Đồ Histogram", type="filepath", height=350)
 
-                test_btn.click(
+                # So sánh chạy tuần tự (1 job một lúc) để không chặn encode/decode nhanh
+                test_event = test_btn.click(
                     fn=run_tests,
                     inputs=[test_image_input, test_message_input],
-                    outputs=[test_gallery, test_table, test_histogram]
+                    outputs=[test_gallery, test_table, test_histogram],
+                    concurrency_limit=1,
+                    concurrency_id="compare"
                 )
+                test_cancel_btn.click(fn=None, inputs=None, outputs=None, cancels=[test_event])
 
             # --- Giới thiệu ---
             with gr.Tab("ℹ️ Giới Thiệu"):
@@ -372,16 +378,18 @@ def create_interface():
                 - Phù hợp khi có kênh truyền an toàn cho file PLS
                 
                 #### **Advanced Mode (LSB + Seeded PLS + Metadata)**
-                - PLS được sinh từ SHA256(key)
-                - Metadata (độ dài message) được mã hóa và nhúng vào **header của ảnh** (16 bits đầu)
+                - PLS được sinh từ subkey PLS dẫn xuất từ khóa bằng HKDF-SHA256 (`StegoKey.seed`)
+                - Metadata (độ dài message, phiên bản PLS, số bit mỗi kênh) được mã hóa và nhúng vào **header của ảnh** (16 bits đầu ghi độ dài metadata)
                 - **Chỉ cần 2 file để giải mã**: Ảnh stego + Khóa AES (không cần file PLS)
                 - Tự động tái tạo PLS từ khóa khi giải mã
                 - Tiện lợi hơn khi truyền/lưu trữ (chỉ cần 2 file thay vì 3)
                 - An toàn vì chỉ người có đúng khóa mới tái tạo được PLS
                 
-                #### **Mã hóa AES**
-                - Tin nhắn được mã hóa AES-256 trước khi giấu vào ảnh
-                - Khóa 256-bit được sinh ngẫu nhiên
+                #### **Mã hóa AES-256-GCM**
+                - Tin nhắn, metadata header và file PLS được mã hóa **AES-256-GCM** (có xác thực) trước khi giấu vào ảnh
+                - Khóa 256-bit được sinh ngẫu nhiên; mỗi vai trò (header, payload, PLS) dùng subkey riêng dẫn xuất bằng HKDF-SHA256
+                - Sai khóa hoặc dữ liệu bị sửa bị phát hiện ngay khi kiểm tra tag
+                - Ảnh và file PLS từ phiên bản cũ (AES-CBC) vẫn giải mã được
                 - Bảo vệ nội dung message ngay cả khi kẻ tấn công biết thuật toán
                 
                 ### 📊 Đánh Giá Chất Lượng
@@ -437,12 +445,15 @@ def create_interface():
                 - Ảnh gốc phải đủ lớn để chứa tin nhắn
                 
                 ⚠️ **Giới hạn:**
-                - Tin nhắn tối đa phụ thuộc vào kích thước ảnh
-                - Công thức: `max_chars ≈ (width × height × 3) / 8`
-                - Ví dụ: Ảnh 512×512 → ~98KB tin nhắn
+                - Tin nhắn tối đa phụ thuộc vào kích thước ảnh, phương pháp và số bit mỗi kênh
+                - Ô "📏 Kích thước tin nhắn tối đa" hiển thị giới hạn chính xác (đã trừ header và overhead AES-GCM), tính bằng `capacity(...)`
+                - Ví dụ: Ảnh 512×512, 1 bit/kênh → ~96KB; 4 bit/kênh → ~384KB
                 """)
+    # Hàng đợi job: giới hạn số request chờ, mỗi nhóm sự kiện có concurrency riêng
+    app.queue(max_size=QUEUE_SIZE, default_concurrency_limit=MAX_WORKERS)
     return app
 
 if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     app = create_interface()
     app.launch(share=True, debug=True)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import numpy as np
+from stego_utils import load_image_array
+
+# Số hàng mỗi tile khi duyệt ảnh (bội số của SSIM_BLOCK)
+DEFAULT_TILE_ROWS = 256
+SSIM_BLOCK = 8
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+def to_gray(rgb: np.ndarray) -> np.ndarray:
+    """RGB -> L bằng số nguyên, cho kết quả giống Image.convert("L") của PIL."""
+    rgb = rgb.astype(np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+def gray_histogram(rgb: np.ndarray, tile_rows: int = DEFAULT_TILE_ROWS) -> np.ndarray:
+    """Histogram 256 bin của ảnh xám, tính theo tile."""
+    hist = np.zeros(256, dtype=np.int64)
+    for r0 in range(0, rgb.shape[0], tile_rows):
+        hist += np.bincount(to_gray(rgb[r0:r0 + tile_rows]).ravel(), minlength=256)
+    return hist
+
+def _channel_histograms(tile: np.ndarray) -> np.ndarray:
+    """Histogram từng kênh R, G, B của một tile, dạng (3, 256)."""
+    shifted = tile.reshape(-1, 3).astype(np.int32) + np.array([0, 256, 512], dtype=np.int32)
+    return np.bincount(shifted.ravel(), minlength=768).reshape(3, 256)
+
+def _block_ssim_sum(gray_a: np.ndarray, gray_b: np.ndarray) -> tuple[float, int]:
+    """Tổng SSIM của các block SSIM_BLOCK x SSIM_BLOCK không chồng lấn trong tile, và số block."""
+    h = gray_a.shape[0] // SSIM_BLOCK * SSIM_BLOCK
+    w = gray_a.shape[1] // SSIM_BLOCK * SSIM_BLOCK
+    if h == 0 or w == 0:
+        return 0.0, 0
+    shape = (h // SSIM_BLOCK, SSIM_BLOCK, w // SSIM_BLOCK, SSIM_BLOCK)
+    a = gray_a[:h, :w].astype(np.float64).reshape(shape)
+    b = gray_b[:h, :w].astype(np.float64).reshape(shape)
+    mu_a = a.mean(axis=(1, 3))
+    mu_b = b.mean(axis=(1, 3))
+    var_a = (a * a).mean(axis=(1, 3)) - mu_a ** 2
+    var_b = (b * b).mean(axis=(1, 3)) - mu_b ** 2
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + _SSIM_C1) * (2 * cov + _SSIM_C2)) / \
+           ((mu_a ** 2 + mu_b ** 2 + _SSIM_C1) * (var_a + var_b + _SSIM_C2))
+    return float(ssim.sum()), ssim.size
+
+def compare_images(original, stego, ssim: bool = False, tile_rows: int = DEFAULT_TILE_ROWS) -> dict:
+    """
+    Tính toàn bộ chỉ số chất lượng trong một lần duyệt theo tile trên dữ liệu uint8:
+    MSE, PSNR, histogram từng kênh, histogram ảnh xám và (tùy chọn) SSIM.
+    Dùng bộ cộng số nguyên; bộ nhớ tạm chỉ cỡ một tile thay vì bản sao float64 cả ảnh.
+
+    original, stego: đường dẫn, bytes, ảnh PIL hoặc mảng (xem load_image_array).
+    SSIM là trung bình SSIM trên các block 8x8 không chồng lấn của ảnh xám.
+    Trả về dict: mse, psnr, channel_hist_orig, channel_hist_stego (3x256),
+    gray_hist_orig, gray_hist_stego (256), ssim (hoặc None).
+    """
+    orig = load_image_array(original)
+    steg = load_image_array(stego)
+    if orig.shape != steg.shape:
+        raise ValueError(f"Image size mismatch: {orig.shape} vs {steg.shape}")
+    tile_rows = max(SSIM_BLOCK, tile_rows // SSIM_BLOCK * SSIM_BLOCK)
+
+    sq_err = 0
+    channel_orig = np.zeros((3, 256), dtype=np.int64)
+    channel_steg = np.zeros((3, 256), dtype=np.int64)
+    gray_orig = np.zeros(256, dtype=np.int64)
+    gray_steg = np.zeros(256, dtype=np.int64)
+    ssim_sum, ssim_blocks = 0.0, 0
+
+    for r0 in range(0, orig.shape[0], tile_rows):
+        o = orig[r0:r0 + tile_rows]
+        s = steg[r0:r0 + tile_rows]
+
+        diff = (o.astype(np.int64) - s).ravel()
+        sq_err += int(np.dot(diff, diff))
+
+        channel_orig += _channel_histograms(o)
+        channel_steg += _channel_histograms(s)
+
+        go, gs = to_gray(o), to_gray(s)
+        gray_orig += np.bincount(go.ravel(), minlength=256)
+        gray_steg += np.bincount(gs.ravel(), minlength=256)
+
+        if ssim:
+            tile_sum, tile_blocks = _block_ssim_sum(go, gs)
+            ssim_sum += tile_sum
+            ssim_blocks += tile_blocks
+
+    mse = sq_err / orig.size
+    psnr = float("inf") if mse == 0 else 20 * np.log10(255.0 / np.sqrt(mse))
+    return {
+        "mse": mse,
+        "psnr": psnr,
+        "channel_hist_orig": channel_orig,
+        "channel_hist_stego": channel_steg,
+        "gray_hist_orig": gray_orig,
+        "gray_hist_stego": gray_steg,
+        "ssim": ssim_sum / ssim_blocks if ssim and ssim_blocks else None,
+    }
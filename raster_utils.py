@@ -0,0 +1,331 @@
+import os
+import math
+import shutil
+import logging
+import numpy as np
+from PIL import Image
+from crypto_utils import StegoKey, as_stego_key, decrypt_any
+from instrumentation import NULL_INSTRUMENTATION
+from stego_utils import (format_metadata, metadata_bits, pls_slot_source, pls_slots, pls_slots_v2, generate_pls_seeded,
+                         pack_pls_seed, plan_update,
+                         lsb_match_array, bytes_to_bits, bits_to_bytes, _feistel_round_keys,
+                         PAYLOAD_AAD, PLS_AAD)
+
+logger = logging.getLogger(__name__)
+
+# Số bit xử lý mỗi đoạn: bộ nhớ tạm tỉ lệ với đoạn, không phụ thuộc kích thước ảnh
+TILE_BITS = 1 << 18
+
+# Đọc thưa (sparse): gộp các offset cách nhau <= READ_GAP byte thành một lần đọc;
+# payload tới SPARSE_MAX_BITS bit được đọc một lượt theo offset đã sắp xếp
+READ_GAP = 4096
+SPARSE_MAX_BITS = 1 << 20
+
+# Rawmode không nén được hỗ trợ và thứ tự kênh R, G, B trong file
+_RAW_CHANNELS = {"RGB": (0, 1, 2), "BGR": (2, 1, 0)}
+
+class Raster:
+    """
+    Ảnh cover không nén (PPM, BMP 24-bit, TGA, TIFF không nén, hoặc raw RGB) truy cập
+    trực tiếp trên file qua numpy.memmap, không giải mã cả ảnh.
+    Slot (pixel * 3 + kênh) được ánh xạ sang offset byte trong file theo bố cục strip
+    mà PIL đọc được từ header (hướng dòng, stride, thứ tự kênh).
+
+    path: đường dẫn file; raw RGB không header thì truyền size=(width, height).
+    writable=True mở file để sửa trực tiếp (ghi tại chỗ).
+    """
+
+    def __init__(self, path, writable: bool = False, size: tuple[int, int] = None, offset: int = 0):
+        self.path = path
+        if size is not None:
+            width, height = size
+            strips = [(0, height, offset, width * 3, 1, _RAW_CHANNELS["RGB"])]
+        else:
+            width, height, strips = self._parse_layout(path)
+        self.width, self.height = width, height
+        self.total_pixels = width * height
+
+        # Bảng strip (sắp theo dòng bắt đầu) để tra offset vector hóa
+        strips.sort()
+        self._y0 = np.array([s[0] for s in strips], dtype=np.int64)
+        self._y1 = np.array([s[1] for s in strips], dtype=np.int64)
+        self._base = np.array([s[2] for s in strips], dtype=np.int64)
+        self._stride = np.array([s[3] for s in strips], dtype=np.int64)
+        self._flip = np.array([s[4] == -1 for s in strips])
+        self._channels = np.array([s[5] for s in strips], dtype=np.int64)
+
+        end = int((self._base + (self._y1 - self._y0) * self._stride).max())
+        if end > os.path.getsize(path):
+            raise ValueError(f"Truncated raster file: {path}")
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r+" if writable else "r")
+        self.read_calls = 0
+        self.bytes_read = 0
+
+    @staticmethod
+    def _parse_layout(path) -> tuple[int, int, list]:
+        """Đọc header bằng PIL, trả về (width, height, strips) nếu ảnh là RGB không nén."""
+        with Image.open(path) as im:
+            if im.mode != "RGB":
+                raise ValueError(f"Raster access needs an RGB image, got mode {im.mode}")
+            width, height = im.size
+            strips = []
+            for tile in im.tile:
+                codec, (x0, y0, x1, y1), offset, args = tile
+                args = (args,) if isinstance(args, str) else tuple(args)
+                rawmode, stride, orientation = (args + (0, 1))[:3]
+                if codec != "raw" or rawmode not in _RAW_CHANNELS or x0 != 0 or x1 != width:
+                    raise ValueError(f"Unsupported (compressed or tiled) image layout: {path}")
+                strips.append((y0, y1, offset, stride or width * 3, orientation or 1, _RAW_CHANNELS[rawmode]))
+        # Một số codec (WebP) giải mã không qua tile -> không có layout trong file
+        if not strips:
+            raise ValueError(f"Unsupported (compressed or tiled) image layout: {path}")
+        return width, height, strips
+
+    def offsets(self, slots: np.ndarray) -> np.ndarray:
+        """Offset byte trong file của các slot."""
+        slots = np.asarray(slots, dtype=np.int64)
+        pixel, channel = np.divmod(slots, 3)
+        y, x = np.divmod(pixel, self.width)
+        s = np.searchsorted(self._y0, y, side="right") - 1
+        row = y - self._y0[s]
+        row = np.where(self._flip[s], self._y1[s] - self._y0[s] - 1 - row, row)
+        return self._base[s] + row * self._stride[s] + x * 3 + self._channels[s, channel]
+
+    def read(self, slots: np.ndarray) -> np.ndarray:
+        """Giá trị uint8 của các slot (theo thứ tự slots); đọc theo offset tăng dần."""
+        offsets = self.offsets(slots)
+        order = np.argsort(offsets, kind="stable")
+        values = np.empty(len(offsets), dtype=np.uint8)
+        values[order] = self._mm[offsets[order]]
+        return values
+
+    def read_sparse(self, slots: np.ndarray, max_gap: int = READ_GAP) -> np.ndarray:
+        """
+        Giá trị uint8 của các slot, đọc thẳng từ file: offset được sắp xếp, gộp thành các
+        đoạn liên tiếp (khoảng trống <= max_gap) và đọc từng đoạn một lần, rồi trả về
+        theo đúng thứ tự slots (thứ tự PLS).
+        """
+        offsets = self.offsets(slots)
+        if len(offsets) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        unique, inverse = np.unique(offsets, return_inverse=True)
+        starts, stops = _coalesce(unique, max_gap)
+        lengths = stops - starts
+        positions = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        buf = np.empty(int(lengths.sum()), dtype=np.uint8)
+        view = memoryview(buf)
+        with open(self.path, "rb") as f:
+            for start, length, pos in zip(starts.tolist(), lengths.tolist(), positions.tolist()):
+                f.seek(start)
+                if f.readinto(view[pos:pos + length]) != length:
+                    raise ValueError(f"Truncated raster file: {self.path}")
+        self.read_calls += len(starts)
+        self.bytes_read += len(buf)
+
+        r = np.searchsorted(starts, unique, side="right") - 1
+        return buf[unique - starts[r] + positions[r]][inverse.reshape(-1)]
+
+    def write(self, slots: np.ndarray, values: np.ndarray):
+        """Ghi giá trị uint8 vào các slot, trực tiếp trên file."""
+        offsets = self.offsets(slots)
+        order = np.argsort(offsets, kind="stable")
+        self._mm[offsets[order]] = np.asarray(values, dtype=np.uint8)[order]
+
+    def read_lsb(self, start: int, stop: int) -> np.ndarray:
+        """LSB của các slot [start, stop) (dùng cho header Advanced mode)."""
+        return self.read_sparse(np.arange(start, stop)) & 1
+
+    def embed(self, slots: np.ndarray, bits: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+        """LSB matching trên các slot; chỉ ghi các byte có LSB khác bit, trả về các slot đó."""
+        values = self.read(slots)
+        changed = (values & 1) != bits
+        self.write(slots[changed], lsb_match_array(values[changed], bits[changed], rng))
+        return slots[changed]
+
+    def flush(self):
+        if self._mm.mode == "r+":
+            self._mm.flush()
+
+    def close(self):
+        self.flush()
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _coalesce(offsets: np.ndarray, max_gap: int) -> tuple[np.ndarray, np.ndarray]:
+    """Gộp các offset đã sắp xếp (không trùng) thành các đoạn [start, stop)."""
+    breaks = np.flatnonzero(np.diff(offsets) > max_gap) + 1
+    starts = offsets[np.concatenate([[0], breaks])]
+    stops = offsets[np.concatenate([breaks - 1, [len(offsets) - 1]])] + 1
+    return starts, stops
+
+def encode_lsb_raster(cover, message: str | bytes, stego_path, pls_enc_path, key: bytes | StegoKey, mode: str = "advanced",
+                      size: tuple[int, int] = None, tile_bits: int = TILE_BITS, metrics=None) -> bytes | None:
+    """
+    Nhúng message vào ảnh cover không nén, sửa trực tiếp trên file theo từng đoạn tile_bits bit.
+    Bộ nhớ tạm tỉ lệ với tile_bits thay vì kích thước ảnh; chỉ các byte được PLS chọn bị đọc/ghi.
+
+    stego_path: file kết quả (cover được copy sang trước), hoặc None để sửa cover tại chỗ.
+    PLS dùng phiên bản 2 (hoán vị có khóa) giống encode_lsb_stream:
+        Advanced mode: pls_enc_path = None, metadata ghi pls=2
+        Simple mode: file PLS chỉ chứa seed
+    Trả về file PLS đã mã hóa (Simple mode) hoặc None.
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
+    mode = mode.lower()
+    if mode not in ("simple", "advanced"):
+        raise ValueError(f"Invalid mode: {mode}")
+
+    target = cover
+    if stego_path is not None and os.path.abspath(stego_path) != os.path.abspath(cover):
+        with metrics.stage("copy"):
+            shutil.copyfile(cover, stego_path)
+        target = stego_path
+
+    with metrics.stage("encrypt"):
+        payload = message.encode() if isinstance(message, str) else bytes(message)
+        encrypted_msg = key.encrypt(payload, "payload", PAYLOAD_AAD)
+    needed_bits = len(encrypted_msg) * 8
+    metrics.count("payload_bytes", len(payload))
+    metrics.count("bits", needed_bits)
+
+    rng = np.random.default_rng()
+    try:
+        with Raster(target, writable=True, size=size) as raster:
+            total_pixels = raster.total_pixels
+            # Tính header và kiểm tra dung lượng trước khi ghi bất kỳ byte nào
+            if mode == "advanced":
+                header = metadata_bits(format_metadata(len(encrypted_msg), pls=2), key)
+                offset = math.ceil(len(header) / 3)
+                if offset > total_pixels:
+                    raise ValueError(f"Image too small: need {offset} pixels for metadata")
+                round_keys = _feistel_round_keys(key.pls_key)
+            else:
+                header = None
+                offset = 0
+                seed = int.from_bytes(os.urandom(8), "big")
+                round_keys = _feistel_round_keys(seed.to_bytes(8, "big"))
+
+            domain = total_pixels - offset
+            needed_pixels = math.ceil(needed_bits / 3)
+            if needed_pixels > domain:
+                raise ValueError(f"Not enough pixels: need {needed_pixels}, available {domain}")
+
+            if header is not None:
+                with metrics.stage("metadata"):
+                    raster.embed(np.arange(len(header)), header, rng)
+                logger.info("[Advanced] Metadata embedded in %d pixels", offset)
+
+            bits = bytes_to_bits(encrypted_msg)
+            with metrics.stage("embed"):
+                for start in range(0, needed_bits, tile_bits):
+                    stop = min(start + tile_bits, needed_bits)
+                    raster.embed(pls_slots_v2(start, stop, offset, domain, round_keys), bits[start:stop], rng)
+            metrics.count("pixels", needed_pixels + offset)
+    except BaseException:
+        # Không để lại bản copy ghi dở
+        if target != cover:
+            os.remove(target)
+        raise
+    logger.info("[%s] Stego raster written: %s", mode.upper(), target)
+
+    enc_pls = None
+    if mode == "simple":
+        enc_pls = key.encrypt(pack_pls_seed(seed, needed_bits, version=2), "pls", PLS_AAD)
+        if isinstance(pls_enc_path, (str, os.PathLike)):
+            with open(pls_enc_path, "wb") as f:
+                f.write(enc_pls)
+            logger.info("[SIMPLE] PLS saved: %s", pls_enc_path)
+        elif pls_enc_path is not None:
+            pls_enc_path.write(enc_pls)
+    return enc_pls
+
+def update_lsb_raster(stego, message: str | bytes, key: bytes | StegoKey, size: tuple[int, int] = None,
+                      tile_bits: int = TILE_BITS, metrics=None) -> int:
+    """
+    Thay message trong ảnh stego Advanced mode không nén, sửa trực tiếp trên file
+    (giống stego_utils.update_lsb): chỉ các byte có LSB khác bit mới bị ghi,
+    nên thời gian tỉ lệ với payload chứ không với kích thước ảnh.
+    Ảnh PLS v1 (encode_lsb) vẫn được hỗ trợ nhưng cần sinh toàn bộ PLS trước.
+    Trả về số pixel bị đổi.
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
+    payload = message.encode() if isinstance(message, str) else bytes(message)
+    rng = np.random.default_rng()
+    with Raster(stego, writable=True, size=size) as raster:
+        total_pixels = raster.total_pixels
+        with metrics.stage("metadata"):
+            header, offset, encrypted, fields = plan_update(raster.read_lsb, total_pixels * 3, key, payload)
+        if "depth" in fields:
+            raise ValueError("Images embedded with depth > 1 must be updated with update_lsb")
+        needed_bits = len(encrypted) * 8
+        domain = total_pixels - offset
+        if math.ceil(needed_bits / 3) > domain:
+            raise ValueError(f"Not enough pixels: need {math.ceil(needed_bits / 3)}, available {domain}")
+
+        changed = []
+        if header is not None:
+            changed.append(raster.embed(np.arange(len(header)), header, rng))
+        if fields.get("pls", 1) == 2:
+            round_keys = _feistel_round_keys(key.pls_key)
+            def slots_for(start, stop):
+                return pls_slots_v2(start, stop, offset, domain, round_keys)
+        else:
+            all_slots = pls_slots(generate_pls_seeded(total_pixels, needed_bits, key, offset, version=1))
+            def slots_for(start, stop):
+                return all_slots[start:stop]
+        bits = bytes_to_bits(encrypted)
+        with metrics.stage("embed"):
+            for start in range(0, needed_bits, tile_bits):
+                stop = min(start + tile_bits, needed_bits)
+                changed.append(raster.embed(slots_for(start, stop), bits[start:stop], rng))
+    changed_pixels = len(np.unique(np.concatenate(changed) // 3))
+    metrics.count("payload_bytes", len(payload))
+    metrics.count("bits", needed_bits)
+    metrics.count("changed_pixels", changed_pixels)
+    logger.info("[Update] %d pixels changed in %s", changed_pixels, stego)
+    return changed_pixels
+
+def decode_lsb_raster(stego, pls_enc_path, key: bytes | StegoKey, size: tuple[int, int] = None,
+                      tile_bits: int = TILE_BITS, sparse: bool = None, metrics=None,
+                      as_bytes: bool = False) -> str | bytes:
+    """
+    Trích xuất message từ ảnh stego không nén, chỉ đọc các byte được PLS chọn.
+    Hỗ trợ cả ảnh do encode_lsb tạo (PLS v1, sidecar danh sách) nếu được lưu không nén.
+
+    sparse=True: sắp xếp toàn bộ vị trí PLS, đọc bằng các lần đọc gộp (read_sparse) rồi
+    đưa bit về thứ tự PLS; thời gian gần như không phụ thuộc kích thước ảnh.
+    sparse=False: đọc qua memmap theo từng đoạn tile_bits bit (hợp với payload lớn).
+    sparse=None (mặc định): dùng sparse khi payload không quá SPARSE_MAX_BITS bit.
+    as_bytes: trả về payload dạng bytes thay vì giải mã UTF-8.
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    with Raster(stego, size=size) as raster:
+        with metrics.stage("pls"):
+            n_bits, slots_for, key = pls_slot_source(raster.total_pixels, pls_enc_path, key, raster.read_lsb)
+        n_bits -= n_bits % 8
+        if sparse is None:
+            sparse = n_bits <= SPARSE_MAX_BITS
+        with metrics.stage("extract"):
+            if sparse:
+                bits = raster.read_sparse(slots_for(0, n_bits)) & 1
+            else:
+                # Thêm mảng rỗng để payload 0 bit không làm np.concatenate lỗi
+                bits = np.concatenate([np.zeros(0, np.uint8)] +
+                                      [raster.read(slots_for(start, min(start + tile_bits, n_bits))) & 1
+                                       for start in range(0, n_bits, tile_bits)])
+        metrics.count("read_calls", raster.read_calls)
+        metrics.count("bytes_read", raster.bytes_read)
+    metrics.count("bits", n_bits)
+
+    with metrics.stage("decrypt"):
+        payload = decrypt_any(bits_to_bytes(bits), key.payload_key, PAYLOAD_AAD)
+    metrics.count("payload_bytes", len(payload))
+    return payload if as_bytes else payload.decode()
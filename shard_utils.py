@@ -0,0 +1,114 @@
+import os
+import math
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from crypto_utils import StegoKey, as_stego_key
+from stego_utils import (load_image_array, save_image_array, image_size, format_metadata, header_pixels_for,
+                         embed_payload, extract_payload, PAYLOAD_AAD)
+
+# Mỗi shard là một ảnh Advanced mode (PLS v2) với metadata:
+#   advanced:<n_bytes>:pls=2:set=<id>:shard=<i>/<N>:size=<tổng byte>:sha256=<digest>
+# Ghép các shard theo thứ tự i, kiểm tra size + sha256 rồi mới giải mã AES.
+
+def _split_sizes(total: int, capacities: list[int]) -> list[int]:
+    """Chia total byte theo tỉ lệ capacity để mật độ nhúng đều giữa các ảnh."""
+    cap_sum = sum(capacities)
+    if total > cap_sum:
+        raise ValueError(f"Payload too large for cover set: {total} bytes, capacity {cap_sum} bytes")
+    sizes = [total * cap // cap_sum for cap in capacities]
+    # Phần dư chia cho các ảnh còn chỗ
+    remainder = total - sum(sizes)
+    for i in sorted(range(len(sizes)), key=lambda i: capacities[i] - sizes[i], reverse=True):
+        if remainder == 0:
+            break
+        take = min(remainder, capacities[i] - sizes[i])
+        sizes[i] += take
+        remainder -= take
+    return sizes
+
+def _embed_shard(cover, data: bytes, stego_path, key: bytes | StegoKey, fields: dict) -> np.ndarray:
+    """Nhúng một shard vào cover (chạy trong process con)."""
+    pixels = np.array(load_image_array(cover))
+    embed_payload(pixels, data, key, **fields)
+    if stego_path is not None:
+        save_image_array(pixels, stego_path)
+    return pixels
+
+def _extract_shard(stego, key: bytes | StegoKey) -> tuple[bytes, dict]:
+    """Trích xuất một shard (chạy trong process con)."""
+    return extract_payload(load_image_array(stego), key)
+
+def encode_shards(covers: list, message: str | bytes, stego_paths: list, key: bytes | StegoKey,
+                  workers: int = None) -> list[np.ndarray]:
+    """
+    Chia payload đã mã hóa AES ra nhiều ảnh cover và nhúng song song.
+    stego_paths: đường dẫn/file-like cho từng shard (hoặc None để chỉ trả về mảng).
+    Trả về danh sách mảng ảnh stego theo thứ tự cover.
+    """
+    if len(covers) != len(stego_paths):
+        raise ValueError("covers and stego_paths must have the same length")
+
+    key = as_stego_key(key)
+    payload = message.encode() if isinstance(message, str) else bytes(message)
+    encrypted = key.encrypt(payload, "payload", PAYLOAD_AAD)
+    n_shards = len(covers)
+    common = {
+        "set": os.urandom(4).hex(),
+        "size": len(encrypted),
+        "sha256": hashlib.sha256(encrypted).hexdigest(),
+    }
+
+    # Capacity mỗi ảnh (byte) sau khi trừ header; dùng metadata dài nhất để ước lượng header
+    longest = format_metadata(len(encrypted), pls=2, **common, shard=f"{n_shards}/{n_shards}")
+    capacities = [max(0, (math.prod(image_size(c)) - header_pixels_for(longest)) * 3 // 8) for c in covers]
+    sizes = _split_sizes(len(encrypted), capacities)
+
+    jobs = []
+    start = 0
+    for i, (cover, stego_path, size) in enumerate(zip(covers, stego_paths, sizes)):
+        fields = {**common, "shard": f"{i}/{n_shards}"}
+        jobs.append((cover, encrypted[start:start + size], stego_path, key, fields))
+        start += size
+
+    if workers == 1:
+        return [_embed_shard(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_embed_shard, *zip(*jobs)))
+
+def decode_shards(stegos: list, key: bytes | StegoKey, workers: int = None) -> bytes:
+    """
+    Trích xuất song song các shard (thứ tự bất kỳ), ghép lại, kiểm tra toàn vẹn
+    (đủ shard, cùng bộ, kích thước, SHA-256) rồi giải mã. Trả về payload dạng bytes.
+    """
+    if workers == 1:
+        shards = [_extract_shard(stego, key) for stego in stegos]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = list(pool.map(_extract_shard, stegos, [key] * len(stegos)))
+
+    if not shards:
+        raise ValueError("No shards given")
+
+    set_ids = {fields.get("set") for _, fields in shards}
+    if len(set_ids) != 1:
+        raise ValueError(f"Shards belong to different sets: {sorted(map(str, set_ids))}")
+
+    parts = {}
+    n_shards = None
+    for data, fields in shards:
+        index, count = map(int, fields["shard"].split("/"))
+        n_shards = count
+        parts[index] = data
+    missing = [i for i in range(n_shards) if i not in parts]
+    if missing:
+        raise ValueError(f"Missing shards: {missing}")
+
+    fields = shards[0][1]
+    encrypted = b"".join(parts[i] for i in range(n_shards))
+    if len(encrypted) != int(fields["size"]):
+        raise ValueError(f"Reassembled size mismatch: {len(encrypted)} != {fields['size']}")
+    if hashlib.sha256(encrypted).hexdigest() != fields["sha256"]:
+        raise ValueError("Reassembled payload failed SHA-256 check")
+
+    return as_stego_key(key).decrypt(encrypted, "payload", PAYLOAD_AAD)[0]
@@ -0,0 +1,253 @@
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from stego_utils import load_image_array
+
+CHANNELS = "RGB"
+TESTS = ("chi", "rs", "spa")
+IMAGE_EXTENSIONS = (".png", ".bmp", ".tif", ".tiff", ".ppm", ".webp")
+
+# Ngưỡng mặc định đánh dấu ảnh nghi ngờ: ước lượng tỉ lệ nhúng (RS/SPA) của kênh cao nhất
+DEFAULT_THRESHOLD = 0.1
+
+# Số pixel tối đa phân tích mỗi ảnh (lấy các dòng giữa ảnh) để thời gian mỗi ảnh có giới hạn
+DEFAULT_MAX_PIXELS = 4_000_000
+
+# Chi-square: bỏ các cặp giá trị có tần suất kỳ vọng quá nhỏ
+CHI_MIN_EXPECTED = 5
+
+# ===== Các phép kiểm tra (một kênh, mảng 2D uint8) =====
+def chi_square(channel: np.ndarray) -> float:
+    """
+    Chi-square attack (Westfeld-Pfitzmann): xác suất các cặp giá trị (2k, 2k+1) đã bị
+    cân bằng bởi nhúng LSB. Gần 1: nghi ngờ, gần 0: ảnh sạch.
+    p-value tính theo xấp xỉ Wilson-Hilferty (không cần scipy).
+    """
+    hist = np.bincount(channel.reshape(-1), minlength=256).astype(np.float64)
+    even, odd = hist[0::2], hist[1::2]
+    expected = (even + odd) / 2
+    keep = expected >= CHI_MIN_EXPECTED
+    df = int(keep.sum()) - 1
+    if df < 1:
+        return 0.0
+    chi2 = float((((even - expected) ** 2)[keep] / expected[keep]).sum())
+    # P(X > chi2) với X ~ chi-square(df)
+    z = ((chi2 / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def _rs_counts(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> tuple[float, float, float, float]:
+    """
+    Tỉ lệ nhóm Regular/Singular của các nhóm (a, b, c, d) với mask [0, 1, 1, 0]:
+    F1 đổi b, c thành x ^ 1, F-1 thành ((x + 1) ^ 1) - 1. Tính theo cột, không tạo bản sao nhóm.
+    """
+    def smoothness(x1, x2):
+        return np.abs(x1 - a) + np.abs(x2 - x1) + np.abs(d - x2)
+
+    base = smoothness(b, c)
+    f_pos = smoothness(b ^ 1, c ^ 1)
+    f_neg = smoothness(((b + 1) ^ 1) - 1, ((c + 1) ^ 1) - 1)
+    n = len(a)
+    return (np.count_nonzero(f_pos > base) / n, np.count_nonzero(f_pos < base) / n,
+            np.count_nonzero(f_neg > base) / n, np.count_nonzero(f_neg < base) / n)
+
+def _quadratic_roots(a: float, b: float, c: float) -> tuple[float, ...] | None:
+    """
+    Nghiệm thực của a*x^2 + b*x + c = 0 cho các bộ ước lượng.
+    Delta < 0 (hai nghiệm gần nhau bị nhiễu đẩy ra số phức, thường khi tỉ lệ nhúng gần 1):
+    lấy đỉnh -b / 2a. None nếu phương trình suy biến (a = b = 0).
+    """
+    if a == 0:
+        return (-c / b,) if b else None
+    disc = b * b - 4 * a * c
+    if disc < 0:
+        return (-b / (2 * a),)
+    return ((-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a))
+
+def rs_analysis(channel: np.ndarray) -> float:
+    """
+    RS analysis (Fridrich): ước lượng tỉ lệ nhúng LSB từ số nhóm 4 pixel ngang
+    Regular/Singular trước và sau khi đảo toàn bộ LSB. Trả về giá trị trong [0, 1],
+    NaN nếu phương trình suy biến.
+    """
+    width = channel.shape[1] - channel.shape[1] % 4
+    groups = channel[:, :width].reshape(-1, 4).astype(np.int16)
+    if len(groups) == 0:
+        return 0.0
+    columns = [np.ascontiguousarray(groups[:, i]) for i in range(4)]
+    r, s, r_neg, s_neg = _rs_counts(*columns)
+    r1, s1, r1_neg, s1_neg = _rs_counts(*(col ^ 1 for col in columns))
+
+    d0, d1 = r - s, r1 - s1
+    dn0, dn1 = r_neg - s_neg, r1_neg - s1_neg
+    a = 2 * (d1 + d0)
+    b = dn0 - dn1 - d1 - 3 * d0
+    c = d0 - dn0
+    roots = _quadratic_roots(a, b, c)
+    if roots is None:
+        return math.nan
+    z = min(roots, key=abs)
+    if z == 0.5:
+        return 1.0
+    return float(min(max(0.0, z / (z - 0.5)), 1.0))
+
+def sample_pair_analysis(channel: np.ndarray) -> float:
+    """
+    Sample pair analysis (Dumitrescu-Wu-Wang) trên các cặp pixel kề nhau theo hàng.
+    Ước lượng là nghiệm nhỏ hơn của phương trình bậc hai (a >= 0), cắt về [0, 1];
+    NaN nếu phương trình suy biến (vd ảnh một màu).
+    """
+    u = channel[:, :-1].reshape(-1).astype(np.int16)
+    v = channel[:, 1:].reshape(-1).astype(np.int16)
+    n_pairs = len(u)
+    if n_pairs == 0:
+        return 0.0
+    v_even = (v & 1) == 0
+    x = int(np.count_nonzero(np.where(v_even, u < v, u > v)))
+    y = int(np.count_nonzero(np.where(v_even, u > v, u < v)))
+    w = int(np.count_nonzero(((u >> 1) == (v >> 1)) & (u != v)))
+    z = int(np.count_nonzero(u == v))
+
+    a = (w + z) / 2
+    b = 2 * x - n_pairs
+    c = y - x
+    roots = _quadratic_roots(a, b, c)
+    if roots is None:
+        return math.nan
+    return float(min(max(min(roots), 0.0), 1.0))
+
+ANALYZERS = {"chi": chi_square, "rs": rs_analysis, "spa": sample_pair_analysis}
+
+# ===== Một ảnh =====
+def _crop(pixels: np.ndarray, max_pixels: int) -> np.ndarray:
+    """Giữ các dòng giữa ảnh sao cho không quá max_pixels pixel."""
+    height, width = pixels.shape[:2]
+    if not max_pixels or width * height <= max_pixels:
+        return pixels
+    rows = max(2, max_pixels // width)
+    top = (height - rows) // 2
+    return pixels[top:top + rows]
+
+def analyze_image(image, tests: tuple = TESTS, max_pixels: int = DEFAULT_MAX_PIXELS) -> dict:
+    """
+    Chạy các phép kiểm tra trên từng kênh R, G, B.
+    Trả về {"<test>_<kênh>": giá trị, "<test>": giá trị lớn nhất của các kênh}.
+    Kênh không ước lượng được (NaN) có giá trị None và bị bỏ qua khi lấy max.
+    """
+    pixels = _crop(load_image_array(image), max_pixels)
+    result = {}
+    for test in tests:
+        if test not in ANALYZERS:
+            raise ValueError(f"Invalid test: {test} (expected one of {', '.join(ANALYZERS)})")
+        values = [ANALYZERS[test](np.ascontiguousarray(pixels[:, :, i])) for i in range(3)]
+        channels = {f"{test}_{name}": None if math.isnan(value) else round(value, 6)
+                    for name, value in zip(CHANNELS, values)}
+        result.update(channels)
+        result[test] = max((value for value in channels.values() if value is not None), default=None)
+    return result
+
+def scan_image(path: str, tests: tuple = TESTS, max_pixels: int = DEFAULT_MAX_PIXELS,
+               threshold: float = DEFAULT_THRESHOLD) -> dict:
+    """analyze_image cho một file, kèm đường dẫn, cờ suspect và lỗi (nếu có)."""
+    record = {"path": path}
+    try:
+        record.update(analyze_image(path, tests, max_pixels))
+        estimates = [record[test] for test in ("rs", "spa") if record.get(test) is not None]
+        record["suspect"] = bool(estimates) and max(estimates) > threshold
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+# ===== Quét thư mục =====
+def iter_image_paths(paths: list[str]):
+    """Các file ảnh trong danh sách đường dẫn (thư mục được duyệt đệ quy)."""
+    for path in paths:
+        if os.path.isdir(path):
+            for found in sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True)):
+                if found.lower().endswith(IMAGE_EXTENSIONS):
+                    yield found
+        else:
+            yield path
+
+def scan(paths: list[str], workers: int = None, tests: tuple = TESTS, max_pixels: int = DEFAULT_MAX_PIXELS,
+         threshold: float = DEFAULT_THRESHOLD, chunksize: int = 16):
+    """
+    Quét song song (ProcessPoolExecutor) các ảnh trong paths, sinh kết quả theo thứ tự file.
+    Danh sách file được đọc dần nên thư mục rất lớn không chiếm hết bộ nhớ.
+    """
+    workers = workers or os.cpu_count() or 1
+    files = iter_image_paths(paths)
+    if workers == 1:
+        for path in files:
+            yield scan_image(path, tests, max_pixels, threshold)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for path in files:
+            batch.append(path)
+            # Gửi theo lô để giới hạn số job đang chờ
+            if len(batch) >= workers * chunksize * 4:
+                yield from pool.map(scan_image, batch, *_repeat_args(len(batch), tests, max_pixels, threshold),
+                                    chunksize=chunksize)
+                batch = []
+        if batch:
+            yield from pool.map(scan_image, batch, *_repeat_args(len(batch), tests, max_pixels, threshold),
+                                chunksize=chunksize)
+
+def _repeat_args(n: int, *args):
+    return [[arg] * n for arg in args]
+
+def report_fields(tests: tuple = TESTS) -> list[str]:
+    """Thứ tự cột của báo cáo CSV."""
+    fields = ["path", "status", "suspect"]
+    for test in tests:
+        fields += [test] + [f"{test}_{name}" for name in CHANNELS]
+    return fields + ["error"]
+
+def write_report(records, out, fmt: str = "csv", tests: tuple = TESTS) -> dict:
+    """Ghi kết quả ra out (file text) dạng CSV hoặc JSON Lines; trả về tóm tắt số ảnh."""
+    summary = {"total": 0, "suspect": 0, "error": 0}
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=report_fields(tests), extrasaction="ignore")
+        writer.writeheader()
+    elif fmt != "json":
+        raise ValueError(f"Invalid report format: {fmt}")
+    for record in records:
+        summary["total"] += 1
+        summary["suspect"] += bool(record.get("suspect"))
+        summary["error"] += record["status"] == "error"
+        if writer:
+            writer.writerow(record)
+        else:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Steganalysis LSB (chi-square, RS, SPA) cho thư mục ảnh")
+    parser.add_argument("paths", nargs="+", help="Thư mục hoặc file ảnh")
+    parser.add_argument("-o", "--output", help="File báo cáo (mặc định: stdout)")
+    parser.add_argument("-f", "--format", choices=["csv", "json"], default="csv", help="CSV hoặc JSON Lines")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Số process (mặc định: số CPU)")
+    parser.add_argument("--tests", nargs="*", default=list(TESTS), choices=list(TESTS))
+    parser.add_argument("--max-pixels", type=int, default=DEFAULT_MAX_PIXELS,
+                        help="Số pixel tối đa phân tích mỗi ảnh (0 = toàn bộ)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Ngưỡng tỉ lệ nhúng ước lượng (RS/SPA) để đánh dấu nghi ngờ")
+    args = parser.parse_args()
+
+    tests = tuple(args.tests)
+    records = scan(args.paths, args.workers, tests, args.max_pixels, args.threshold)
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            summary = write_report(records, f, args.format, tests)
+    else:
+        summary = write_report(records, sys.stdout, args.format, tests)
+    print(f"Đã quét {summary['total']} ảnh: {summary['suspect']} nghi ngờ, {summary['error']} lỗi", file=sys.stderr)
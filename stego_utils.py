@@ -1,72 +1,252 @@
 from PIL import Image
 import numpy as np
+import io
 import random
+import os
 import hashlib
 import math
-from crypto_utils import aes_encrypt, aes_decrypt
+import struct
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from crypto_utils import (StegoKey, as_stego_key, pls_seed, aead_encrypt_stream, aead_encrypted_size,
+                          decrypt_any, decrypt_stream_any)
+from instrumentation import NULL_INSTRUMENTATION
+from writer_utils import write_image
+
+logger = logging.getLogger(__name__)
 
 LENGTH_BITS = 16
 
-def generate_pls_seeded(total_pixels: int, needed_bits: int, key: bytes, offset: int = 0) -> list[int]:
+# Phiên bản thuật toán sinh PLS, ghi trong metadata của Advanced mode.
+# Metadata cũ không có trường này được hiểu là phiên bản 1.
+#   1: Fisher-Yates từng phần (random.Random)
+#   2: hoán vị có khóa (Feistel + cycle-walking), tính được từng đoạn -> dùng cho streaming
+PLS_VERSION = 1
+SUPPORTED_PLS_VERSIONS = (1, 2)
+_FEISTEL_ROUNDS = 6
+
+# File PLS nhị phân (Simple mode), trước khi mã hóa AES:
+# magic (4) | version (1) | số byte mỗi index (1) | needed_bits (uint64) | pixel indices
+# Mỗi pixel chỉ lưu một lần, little-endian, độ rộng cố định 4 hoặc 8 byte.
+PLS_FILE_MAGIC = b"PLSB"
+PLS_FILE_VERSION = 1
+_PLS_FILE_HEADER = struct.Struct("<4sBBQ")
+
+# File PLS chỉ chứa seed (Simple mode, pls_format="seed"):
+# magic (4) | version (1) | seed (uint64) | needed_bits (uint64)
+# Khi giải mã, PLS được sinh lại từ seed; version của file chính là phiên bản PLS.
+PLS_SEED_MAGIC = b"PLSS"
+PLS_SEED_VERSION = 1
+_PLS_SEED_HEADER = struct.Struct("<4sBQQ")
+PLS_FORMATS = ("list", "seed")
+
+# Kích thước chunk payload mặc định khi nhúng/trích xuất streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Độ sâu nhúng: số bit thấp dùng trên mỗi kênh được chọn (1 = LSB truyền thống),
+# hoặc ADAPTIVE: độ sâu 1-4 theo độ "nhám" (texture) của từng block ADAPTIVE_BLOCK x ADAPTIVE_BLOCK.
+# Texture tính trên 4 bit cao (không bị nhúng thay đổi) nên bên giải mã tính lại được.
+DEPTHS = (1, 2, 3, 4)
+ADAPTIVE = "adaptive"
+ADAPTIVE_BLOCK = 8
+ADAPTIVE_THRESHOLDS = (1.0, 2.0, 4.0)
+_DEEP_CHUNK_SLOTS = 1 << 18
+
+# Associated data cho AES-GCM: gắn mỗi ciphertext với vai trò của nó
+# (không thể tráo header/payload/PLS giữa các vị trí)
+HEADER_AAD = b"stego:header"
+PAYLOAD_AAD = b"stego:payload"
+PLS_AAD = b"stego:pls"
+
+def _partial_shuffle(start: int, end: int, needed_pixels: int, rng) -> list[int]:
+    """
+    Fisher-Yates từng phần trên [start, end) với dict hoán vị thưa.
+    Cho cùng kết quả với việc shuffle list(range(start, end)) nhưng chỉ tốn
+    bộ nhớ/thời gian O(needed_pixels) thay vì O(số pixel của ảnh).
+    """
+    n = end - start
+    swapped = {}
+    for i in range(n - 1, n - needed_pixels - 1, -1):
+        j = rng.randint(0, i)
+        vi = swapped.get(i, start + i)
+        swapped[i] = swapped.get(j, start + j)
+        swapped[j] = vi
+    return [swapped[i] for i in range(n - needed_pixels, n)]
+
+def _expand_channels(selected_pixels: list[int], needed_bits: int) -> list[int]:
+    """Mỗi pixel được lặp 3 lần (R, G, B), cắt còn needed_bits phần tử."""
+    result = []
+    for px in selected_pixels:
+        for ch in range(3):  # R, G, B
+            result.append(px)
+            if len(result) >= needed_bits:
+                return result
+    return result
+
+@lru_cache(maxsize=256)
+def _feistel_round_keys(seed_material: bytes) -> np.ndarray:
+    """Khóa vòng (uint64, read-only) cho hoán vị Feistel, dẫn xuất từ key hoặc seed; được cache."""
+    digest = hashlib.sha512(seed_material).digest()
+    return np.frombuffer(digest, dtype="<u8")[:_FEISTEL_ROUNDS]
+
+def _mix64(v: np.ndarray) -> np.ndarray:
+    """Hàm trộn 64-bit (splitmix64 finalizer) làm hàm vòng Feistel."""
+    v = v * np.uint64(0xBF58476D1CE4E5B9)
+    v ^= v >> np.uint64(27)
+    v = v * np.uint64(0x94D049BB133111EB)
+    v ^= v >> np.uint64(31)
+    return v
+
+def keyed_permutation(indices: np.ndarray, n: int, round_keys: np.ndarray) -> np.ndarray:
+    """
+    Hoán vị có khóa trên [0, n) (PLS v2): Feistel cân bằng trên miền 2^(2h) >= n,
+    cycle-walking cho các giá trị rơi ra ngoài [0, n).
+    Mỗi index tính độc lập nên sinh PLS theo từng đoạn với bộ nhớ O(đoạn).
+    """
+    half_bits = max(1, math.ceil(max(n - 1, 1).bit_length() / 2))
+    shift = np.uint64(half_bits)
+    mask = np.uint64((1 << half_bits) - 1)
+    
+    out = np.asarray(indices, dtype=np.uint64).copy()
+    todo = np.arange(len(out))
+    current = out.copy()
+    while len(todo):
+        left, right = current >> shift, current & mask
+        for rk in round_keys:
+            left, right = right, left ^ (_mix64(right ^ rk) & mask)
+        current = (left << shift) | right
+        done = current < n
+        out[todo[done]] = current[done]
+        todo, current = todo[~done], current[~done]
+    return out.astype(np.int64)
+
+def pls_slots_v2(bit_start: int, bit_stop: int, offset: int, domain: int, round_keys: np.ndarray) -> np.ndarray:
+    """Slot (pixel * 3 + kênh) cho các bit [bit_start, bit_stop) của PLS v2."""
+    bit_idx = np.arange(bit_start, bit_stop, dtype=np.int64)
+    first_px = bit_start // 3
+    pixels = offset + keyed_permutation(np.arange(first_px, (bit_stop + 2) // 3), domain, round_keys)
+    return pixels[bit_idx // 3 - first_px] * 3 + bit_idx % 3
+
+def generate_pls_seeded(total_pixels: int, needed_bits: int, key: bytes | StegoKey, offset: int = 0,
+                        version: int = PLS_VERSION) -> list[int]:
     """
     PLS dựa trên key cho Advanced mode.
+    key: bytes (dùng trực tiếp) hoặc StegoKey (dùng subkey PLS và seed đã tính sẵn).
     Trả về danh sách needed_bits vị trí (pixel_index, channel_index).
     """
+    if isinstance(key, StegoKey):
+        material, seed = key.pls_key, key.seed
+    else:
+        material, seed = key, pls_seed(key)
+    if version not in SUPPORTED_PLS_VERSIONS:
+        raise ValueError(f"Unsupported PLS version: {version}")
+    
     # Tính số pixel cần thiết
     needed_pixels = math.ceil(needed_bits / 3)
     
     if needed_pixels > (total_pixels - offset):
         raise ValueError(f"Not enough pixels: need {needed_pixels}, available {total_pixels - offset}")
     
-    # Tạo seed từ key
-    seed = int(hashlib.sha256(key).hexdigest(), 16) % (2**32)
-    random.seed(seed)
+    if version == 2:
+        pixels = offset + keyed_permutation(np.arange(needed_pixels), total_pixels - offset, _feistel_round_keys(material))
+        return np.repeat(pixels, 3)[:needed_bits]
     
-    # Tạo mảng pixel từ offset
-    arr = list(range(offset, total_pixels))
+    # random.Random riêng cho mỗi lần gọi (cùng chuỗi với random.seed(seed)
+    # nhưng không đụng tới RNG toàn cục, an toàn khi nhiều thread encode cùng lúc)
+    rng = random.Random(seed)
     
-    # Fisher-Yates shuffle: shuffle đúng needed_pixels phần tử cuối
-    for i in range(len(arr)-1, len(arr)-needed_pixels-1, -1):
-        j = random.randint(0, i)
-        arr[i], arr[j] = arr[j], arr[i]
+    # Fisher-Yates: chọn needed_pixels pixel trong [offset, total_pixels)
+    selected_pixels = _partial_shuffle(offset, total_pixels, needed_pixels, rng)
+    return _expand_channels(selected_pixels, needed_bits)
+
+def generate_pls(total_pixels: int, needed_bits: int, version: int = PLS_VERSION,
+                 rng: random.Random = None) -> list[int]:
+    """
+    Random PLS cho Simple mode. rng mặc định là random.Random() mới (seed từ OS).
+    version=2: hoán vị Feistel với seed ngẫu nhiên lấy từ rng (như generate_pls_from_seed).
+    """
+    if version not in SUPPORTED_PLS_VERSIONS:
+        raise ValueError(f"Unsupported PLS version: {version}")
+    rng = rng or random.Random()
+    if version == 2:
+        return generate_pls_from_seed(total_pixels, needed_bits, rng.getrandbits(64), version)
     
-    # Lấy needed_pixels cuối và expand ra 3 channels
-    selected_pixels = arr[len(arr)-needed_pixels:]
-    result = []
-    for px in selected_pixels:
-        for ch in range(3):  # R, G, B
-            result.append(px)
-            if len(result) >= needed_bits:
-                return result
+    needed_pixels = math.ceil(needed_bits / 3)
     
-    return result
+    if needed_pixels > total_pixels:
+        raise ValueError(f"Not enough pixels: need {needed_pixels}, available {total_pixels}")
+    
+    selected_pixels = _partial_shuffle(0, total_pixels, needed_pixels, rng)
+    return _expand_channels(selected_pixels, needed_bits)
 
-def generate_pls(total_pixels: int, needed_bits: int) -> list[int]:
-    """Random PLS cho Simple mode."""
+def generate_pls_from_seed(total_pixels: int, needed_bits: int, seed: int, version: int = PLS_VERSION) -> list[int]:
+    """PLS cho Simple mode sinh từ seed riêng của message (pls_format="seed")."""
+    if version not in SUPPORTED_PLS_VERSIONS:
+        raise ValueError(f"Unsupported PLS version: {version}")
+    
     needed_pixels = math.ceil(needed_bits / 3)
     
     if needed_pixels > total_pixels:
         raise ValueError(f"Not enough pixels: need {needed_pixels}, available {total_pixels}")
     
-    arr = list(range(total_pixels))
+    if version == 2:
+        pixels = keyed_permutation(np.arange(needed_pixels), total_pixels, _feistel_round_keys(seed.to_bytes(8, "big")))
+        return np.repeat(pixels, 3)[:needed_bits]
     
-    # Fisher-Yates shuffle
-    for i in range(len(arr)-1, len(arr)-needed_pixels-1, -1):
-        j = random.randint(0, i)
-        arr[i], arr[j] = arr[j], arr[i]
+    selected_pixels = _partial_shuffle(0, total_pixels, needed_pixels, random.Random(seed))
+    return _expand_channels(selected_pixels, needed_bits)
+
+def pack_pls_seed(seed: int, needed_bits: int, version: int = PLS_SEED_VERSION, depth: int | str = 1) -> bytes:
+    """
+    Đóng gói file PLS chỉ gồm seed và số bit.
+    depth khác 1 (chỉ với PLS v2) được ghi thêm một byte cuối: 1-4, hoặc 0 = adaptive.
+    """
+    data = _PLS_SEED_HEADER.pack(PLS_SEED_MAGIC, version, seed, needed_bits)
+    if depth != 1:
+        data += bytes([0 if depth == ADAPTIVE else depth])
+    return data
+
+def pls_depth(data: bytes) -> int | str:
+    """Độ sâu nhúng ghi trong file PLS đã giải mã (1 nếu không ghi)."""
+    if data.startswith(PLS_SEED_MAGIC) and len(data) > _PLS_SEED_HEADER.size:
+        code = data[_PLS_SEED_HEADER.size]
+        return ADAPTIVE if code == 0 else check_depth(code)
+    return 1
+
+def pack_pls(pls) -> bytes:
+    """Đóng gói PLS thành file nhị phân: mỗi pixel lưu một lần."""
+    pixels = np.asarray(pls, dtype=np.int64)[::3]
+    width = 4 if len(pixels) == 0 or pixels.max() < 2**32 else 8
+    header = _PLS_FILE_HEADER.pack(PLS_FILE_MAGIC, PLS_FILE_VERSION, width, len(pls))
+    return header + pixels.astype(f"<u{width}").tobytes()
+
+def unpack_pls(data: bytes, total_pixels: int) -> np.ndarray:
+    """
+    Đọc PLS từ file đã giải mã, trả về mảng needed_bits vị trí.
+    Hỗ trợ file seed, file nhị phân lẫn định dạng cũ "i,j,k,..." dạng text.
+    """
+    if data.startswith(PLS_SEED_MAGIC):
+        _, version, seed, needed_bits = _PLS_SEED_HEADER.unpack_from(data)
+        if version not in SUPPORTED_PLS_VERSIONS:
+            raise ValueError(f"Unsupported PLS seed file version: {version}")
+        return np.asarray(generate_pls_from_seed(total_pixels, needed_bits, seed, version), dtype=np.int64)
     
-    # Expand pixels to channels
-    selected_pixels = arr[len(arr)-needed_pixels:]
-    result = []
-    for px in selected_pixels:
-        for ch in range(3):
-            result.append(px)
-            if len(result) >= needed_bits:
-                return result
+    if not data.startswith(PLS_FILE_MAGIC):
+        return np.array(data.split(b","), dtype=np.int64)
     
-    return result
+    _, version, width, needed_bits = _PLS_FILE_HEADER.unpack_from(data)
+    if version != PLS_FILE_VERSION:
+        raise ValueError(f"Unsupported PLS file version: {version}")
+    if width not in (4, 8):
+        raise ValueError(f"Invalid PLS index width: {width}")
+    
+    pixels = np.frombuffer(data, dtype=f"<u{width}", offset=_PLS_FILE_HEADER.size)
+    if len(pixels) * 3 < needed_bits:
+        raise ValueError("Incomplete PLS file")
+    return np.repeat(pixels.astype(np.int64), 3)[:needed_bits]
 
-def lsb_match(value, bit):
+def lsb_match(value, bit, rng: random.Random = None):
     """LSB matching: thay đổi value ±1 nếu LSB không khớp."""
     bit = int(bit)
     if (value & 1) == bit:
@@ -75,234 +255,947 @@ def lsb_match(value, bit):
         return 254
     if value == 0: 
         return 1
-    return value + random.choice([-1, 1])
+    return value + (rng or random.Random()).choice([-1, 1])
 
-def embed_metadata(im, metadata: bytes, key: bytes) -> int:
+def lsb_match_array(values: np.ndarray, bits: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
     """
-    Nhúng metadata vào header của ảnh (Advanced mode).
-    Trả về số pixel đã dùng.
+    LSB matching vector hóa cho cả mảng giá trị uint8.
+    Chỉ đổi ±1 ở các vị trí LSB không khớp; 0 luôn +1, 255 luôn -1.
+    rng: Generator riêng của lần encode (mặc định tạo mới), không dùng RNG toàn cục.
     """
-    # Mã hóa metadata
-    encrypted_metadata = aes_encrypt(metadata, key)
+    rng = rng or np.random.default_rng()
+    values = values.astype(np.int16)
+    mismatch = (values & 1) != bits
+    delta = rng.integers(0, 2, size=values.shape, dtype=np.int16) * 2 - 1
+    delta[values == 0] = 1
+    delta[values == 255] = -1
+    return np.where(mismatch, values + delta, values).astype(np.uint8)
+
+def bytes_to_bits(data: bytes) -> np.ndarray:
+    """Tách bytes thành mảng bit (MSB trước), giống format(b, "08b")."""
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+def pls_slots(pls) -> np.ndarray:
+    """
+    Đổi PLS thành chỉ số trên mảng phẳng H*W*3.
+    Bit thứ i nằm ở pixel pls[i], kênh i % 3.
+    """
+    pls = np.asarray(pls, dtype=np.int64)
+    return pls * 3 + np.arange(len(pls), dtype=np.int64) % 3
+
+def embed_bits(flat: np.ndarray, slots: np.ndarray, bits: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Nhúng bits vào các slot của mảng phẳng (sửa trực tiếp).
+    Chỉ ghi các slot có LSB khác bit; trả về các slot đó.
+    """
+    values = flat[slots]
+    changed = (values & 1) != bits
+    flat[slots[changed]] = lsb_match_array(values[changed], bits[changed], rng)
+    return slots[changed]
+
+def extract_bits(flat: np.ndarray, slots: np.ndarray) -> np.ndarray:
+    """Lấy LSB tại các slot của mảng phẳng (một lần fancy-index)."""
+    return flat[slots] & 1
+
+def bits_to_bytes(bits: np.ndarray) -> bytes:
+    """Gom bits thành bytes (MSB trước), bỏ phần dư không đủ 8 bit."""
+    n_bits = len(bits) - len(bits) % 8
+    return np.packbits(bits[:n_bits]).tobytes()
+
+# ===== Nhúng nhiều bit mỗi kênh (depth 2-4, adaptive) =====
+def check_depth(depth) -> int | str:
+    """Chuẩn hóa depth: 1-4 hoặc ADAPTIVE."""
+    if depth == ADAPTIVE:
+        return ADAPTIVE
+    if str(depth).isdigit() and int(depth) in DEPTHS:
+        return int(depth)
+    raise ValueError(f"Invalid depth: {depth} (expected one of {DEPTHS} or '{ADAPTIVE}')")
+
+def texture_depth_map(pixels: np.ndarray, skip_pixels: int = 0) -> np.ndarray:
+    """
+    Độ sâu (1-4) cho từng pixel theo texture của block chứa nó.
+    Texture = trung bình |chênh lệch| ngang + dọc của 4 bit cao giữa các pixel kề nhau
+    (cộng 3 kênh). skip_pixels pixel đầu (header) được coi như 0 vì header bị sửa sau đó.
+    Trả về mảng phẳng H*W uint8.
+    """
+    height, width = pixels.shape[:2]
+    high = (pixels >> 4).astype(np.int16)
+    if skip_pixels:
+        high.reshape(-1, 3)[:skip_pixels] = 0
+    activity = np.zeros((height, width), dtype=np.int32)
+    activity[:, :-1] += np.abs(np.diff(high, axis=1)).sum(axis=2)
+    activity[:-1, :] += np.abs(np.diff(high, axis=0)).sum(axis=2)
+
+    b = ADAPTIVE_BLOCK
+    bh, bw = -(-height // b), -(-width // b)
+    padded = np.zeros((bh * b, bw * b), dtype=np.int32)
+    padded[:height, :width] = activity
+    counts = np.zeros((bh * b, bw * b), dtype=np.int32)
+    counts[:height, :width] = 1
+    block_sum = padded.reshape(bh, b, bw, b).sum(axis=(1, 3))
+    block_mean = block_sum / counts.reshape(bh, b, bw, b).sum(axis=(1, 3))
+
+    block_depth = (1 + np.searchsorted(ADAPTIVE_THRESHOLDS, block_mean, side="right")).astype(np.uint8)
+    return np.repeat(np.repeat(block_depth, b, axis=0), b, axis=1)[:height, :width].reshape(-1)
+
+def deep_plan(pixels: np.ndarray, offset: int, round_keys: np.ndarray, n_bits: int,
+              depth: int | str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Slot (PLS v2) và độ sâu từng slot để chứa n_bits bit với depth cố định hoặc adaptive.
+    Slot được lấy theo thứ tự hoán vị cho tới khi tổng độ sâu đủ n_bits.
+    """
+    height, width = pixels.shape[:2]
+    domain = width * height - offset
+    if depth != ADAPTIVE:
+        n_slots = math.ceil(n_bits / depth)
+        if math.ceil(n_slots / 3) > domain:
+            raise ValueError(f"Not enough pixels: need {math.ceil(n_slots / 3)}, available {domain}")
+        return pls_slots_v2(0, n_slots, offset, domain, round_keys), np.full(n_slots, depth, dtype=np.uint8)
+
+    depth_map = texture_depth_map(pixels, offset)
+    slots, depths = [], []
+    covered = 0
+    for start in range(0, domain * 3, _DEEP_CHUNK_SLOTS):
+        chunk = pls_slots_v2(start, min(start + _DEEP_CHUNK_SLOTS, domain * 3), offset, domain, round_keys)
+        chunk_depths = depth_map[chunk // 3]
+        cumulative = covered + np.cumsum(chunk_depths, dtype=np.int64)
+        if cumulative[-1] >= n_bits:
+            stop = int(np.searchsorted(cumulative, n_bits)) + 1
+            slots.append(chunk[:stop])
+            depths.append(chunk_depths[:stop])
+            return np.concatenate(slots), np.concatenate(depths)
+        slots.append(chunk)
+        depths.append(chunk_depths)
+        covered = int(cumulative[-1])
+    raise ValueError(f"Not enough capacity: need {n_bits} bits, adaptive capacity {covered} bits")
+
+def _symbol_index(depths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Chỉ số bit (n_slots, 4) của từng slot và mask các bit hợp lệ (j < depth)."""
+    starts = np.concatenate([[0], np.cumsum(depths[:-1], dtype=np.int64)])
+    index = starts[:, None] + np.arange(max(DEPTHS))
+    return index, np.arange(max(DEPTHS)) < depths[:, None].astype(np.int64)
+
+def embed_symbols(flat: np.ndarray, slots: np.ndarray, depths: np.ndarray, bits: np.ndarray,
+                  rng: np.random.Generator = None, keep_high: bool = False) -> np.ndarray:
+    """
+    Ghi depths[i] bit (MSB trước) vào các bit thấp của slot i, chọn giá trị gần giá trị
+    cũ nhất (±2^depth) trong [0, 255]. keep_high=True: không đổi 4 bit cao (adaptive).
+    Bit thiếu ở slot cuối được điền ngẫu nhiên. Trả về các slot bị đổi giá trị.
+    """
+    rng = rng or np.random.default_rng()
+    index, valid = _symbol_index(depths)
+    padded = np.concatenate([bits, rng.integers(0, 2, int(depths.sum(dtype=np.int64)) - len(bits) + max(DEPTHS),
+                                                dtype=np.uint8)])
+    d = depths.astype(np.int16)
+    weights = np.where(valid, 1 << (d[:, None] - 1 - np.arange(max(DEPTHS))).clip(0), 0)
+    symbols = (padded[index] * weights).sum(axis=1).astype(np.int16)
+
+    values = flat[slots].astype(np.int16)
+    step = (1 << d).astype(np.int16)
+    base = (values & ~(step - 1)) | symbols
+    lo, hi = (values & 0xF0, (values & 0xF0) + 15) if keep_high else (0, 255)
+    candidates = np.stack([base - step, base, base + step])
+    allowed = (candidates >= lo) & (candidates <= hi)
+    distance = np.where(allowed, np.abs(candidates - values), 1 << 10)
+    new = candidates[distance.argmin(axis=0), np.arange(len(slots))]
+    changed = new != values
+    flat[slots[changed]] = new[changed].astype(np.uint8)
+    return slots[changed]
+
+def extract_symbols(flat: np.ndarray, slots: np.ndarray, depths: np.ndarray, n_bits: int) -> np.ndarray:
+    """Ngược lại embed_symbols: n_bits bit đầu từ các slot."""
+    index, valid = _symbol_index(depths)
+    d = depths.astype(np.int16)
+    shifts = (d[:, None] - 1 - np.arange(max(DEPTHS))).clip(0)
+    bits = (flat[slots].astype(np.int16)[:, None] >> shifts) & 1
+    return bits[valid][:n_bits].astype(np.uint8)
+
+def format_metadata(n_bytes: int, **fields) -> bytes:
+    """Tạo metadata Advanced mode: "advanced:<n_bytes>[:key=value...]"."""
+    parts = [f"advanced:{n_bytes}"] + [f"{k}={v}" for k, v in fields.items()]
+    return ":".join(parts).encode()
+
+def parse_metadata(metadata: bytes) -> tuple[int, dict]:
+    """
+    Đọc metadata Advanced mode, trả về (n_bytes, fields).
+    Chấp nhận cả định dạng cũ "advanced:<n_bytes>".
+    """
+    metadata_str = metadata.decode(errors="ignore")
+    if not metadata_str.startswith("advanced:"):
+        raise ValueError(f"Invalid metadata format: {metadata_str}")
+    
+    parts = metadata_str.split(":")
+    fields = dict(part.split("=", 1) for part in parts[2:] if "=" in part)
+    return int(parts[1]), fields
+
+def metadata_bits(metadata: bytes, key: bytes | StegoKey) -> np.ndarray:
+    """Bitstream header Advanced mode: LENGTH (16 bit) + metadata đã mã hóa."""
+    encrypted_metadata = as_stego_key(key).encrypt(metadata, "header", HEADER_AAD)
     len_enc = len(encrypted_metadata)
     
     # Kiểm tra giới hạn
     if len_enc > (2 ** LENGTH_BITS) - 1:
         raise ValueError(f"Metadata too large: {len_enc} bytes (max {2**LENGTH_BITS - 1})")
     
-    # Tạo bitstream: LENGTH (16 bits) + encrypted_metadata
-    length_bitstream = format(len_enc, f'0{LENGTH_BITS}b')
-    meta_bitstream = "".join(format(b, "08b") for b in encrypted_metadata)
-    bitstream = length_bitstream + meta_bitstream
+    length_bits = bytes_to_bits(len_enc.to_bytes(LENGTH_BITS // 8, "big"))
+    return np.concatenate([length_bits, bytes_to_bits(encrypted_metadata)])
+
+def read_metadata(read_lsb, n_slots: int, key: bytes | StegoKey) -> tuple[bytes, int, StegoKey]:
+    """
+    Đọc và giải mã header Advanced mode.
+    read_lsb(start, stop): trả về LSB của các slot [start, stop) (header nằm ở các slot đầu).
+    n_slots: tổng số slot của ảnh.
+    Trả về (metadata, số_pixel_đã_dùng, StegoKey đã mở được header) — phần còn lại
+    của ảnh (PLS, payload) dùng cùng StegoKey này.
+    """
+    # Đọc LENGTH_BITS đầu tiên để biết độ dài metadata
+    len_enc = int.from_bytes(bits_to_bytes(read_lsb(0, LENGTH_BITS)), "big")
     
-    total_bits = len(bitstream)
+    # Tính tổng số bits cần đọc
+    total_bits = LENGTH_BITS + len_enc * 8
+    header_pixels = math.ceil(total_bits / 3)
+    
+    if total_bits > n_slots:
+        raise ValueError("Incomplete metadata in header")
+    
+    # Giải mã (AES-GCM: sai key bị từ chối ngay tại đây, trước khi sinh PLS)
+    metadata, used_key = as_stego_key(key).decrypt(bits_to_bytes(read_lsb(LENGTH_BITS, total_bits)), "header", HEADER_AAD)
+    return metadata, header_pixels, used_key
+
+def embed_metadata(pixels: np.ndarray, metadata: bytes, key: bytes | StegoKey, rng: np.random.Generator = None) -> int:
+    """
+    Nhúng metadata vào header của ảnh (Advanced mode).
+    pixels: mảng (H, W, 3) uint8, được sửa trực tiếp.
+    Trả về số pixel đã dùng.
+    """
+    bits = metadata_bits(metadata, key)
+    total_bits = len(bits)
     header_pixels = math.ceil(total_bits / 3)
     
     # Kiểm tra ảnh đủ lớn
-    width, height = im.size
+    height, width = pixels.shape[:2]
     if header_pixels > width * height:
         raise ValueError(f"Image too small: need {header_pixels} pixels for metadata")
     
-    # Nhúng vào ảnh
-    pixels = im.load()
-    idx = 0
-    
-    for px_idx in range(header_pixels):
-        row, col = divmod(px_idx, width)
-        r, g, b = pixels[col, row]
-        
-        # Nhúng 3 bits vào R, G, B
-        for ch in range(3):
-            if idx >= total_bits:
-                break
-            bit = bitstream[idx]
-            
-            if ch == 0:
-                r = lsb_match(r, bit)
-            elif ch == 1:
-                g = lsb_match(g, bit)
-            else:
-                b = lsb_match(b, bit)
-            idx += 1
-        
-        pixels[col, row] = (r, g, b)
+    # Header nằm ở các pixel đầu tiên theo thứ tự R, G, B -> slot = chỉ số bit
+    embed_bits(pixels.reshape(-1), np.arange(total_bits), bits, rng)
     
     return header_pixels
 
-def extract_metadata(im, key: bytes) -> tuple[bytes, int]:
+def extract_metadata(im, key: bytes | StegoKey) -> tuple[bytes, int]:
     """
     Trích xuất metadata từ header (Advanced mode).
+    im: ảnh PIL hoặc mảng (H, W, 3) uint8.
     Trả về (metadata, số_pixel_đã_dùng).
     """
-    pixels = im.load()
-    width, height = im.size
-    
-    # Đọc LENGTH_BITS đầu tiên để biết độ dài metadata
-    length_pixels = math.ceil(LENGTH_BITS / 3)
-    bitstream = ""
-    
-    for px_idx in range(length_pixels):
-        row, col = divmod(px_idx, width)
-        r, g, b = pixels[col, row]
-        bitstream += str(r & 1) + str(g & 1) + str(b & 1)
+    flat = np.asarray(im, dtype=np.uint8).reshape(-1)
+    metadata, header_pixels, _ = read_metadata(lambda start, stop: flat[start:stop] & 1, len(flat), key)
+    return metadata, header_pixels
+
+def load_image_array(image) -> np.ndarray:
+    """
+    Đọc ảnh thành mảng (H, W, 3) uint8, không ghi ra đĩa.
+    image: đường dẫn, bytes, file-like (BytesIO), ảnh PIL hoặc mảng NumPy.
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8:
+            return image
+        image = Image.fromarray(image)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif not isinstance(image, Image.Image):
+        image = Image.open(image)
     
-    len_enc = int(bitstream[:LENGTH_BITS], 2)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image, dtype=np.uint8)
+
+def save_image_array(pixels: np.ndarray, target, profile: str = None, metrics=None) -> int:
+    """
+    Lưu mảng pixel ra đường dẫn hoặc file-like, trả về số byte đã ghi.
+    profile: xem writer_utils.PROFILES (mặc định theo đuôi file, không có thì PNG).
+    """
+    return write_image(pixels, target, profile, metrics)
+
+def _save_stego(pixels: np.ndarray, stego_path, output_profile, writer, metrics):
+    """Ghi ảnh stego ngay hoặc qua writer nền (writer_utils.BackgroundWriter)."""
+    if writer is not None:
+        writer.submit(pixels, stego_path, output_profile)
+    else:
+        save_image_array(pixels, stego_path, output_profile, metrics)
+
+def _read_pls_data(pls_enc) -> bytes:
+    """Đọc file PLS đã mã hóa từ đường dẫn, bytes hoặc file-like."""
+    if isinstance(pls_enc, (bytes, bytearray, memoryview)):
+        return bytes(pls_enc)
+    if isinstance(pls_enc, (str, os.PathLike)):
+        with open(pls_enc, "rb") as f:
+            return f.read()
+    return pls_enc.read()
+
+def header_pixels_for(metadata: bytes) -> int:
+    """Số pixel header cần cho metadata (LENGTH_BITS + metadata đã mã hóa)."""
+    return math.ceil((LENGTH_BITS + aead_encrypted_size(len(metadata)) * 8) / 3)
+
+# ===== Capacity (chỉ đọc header ảnh, không giải mã pixel) =====
+def image_size(image) -> tuple[int, int]:
+    """
+    (width, height) của ảnh; với đường dẫn, bytes và file-like chỉ đọc header.
+    image: giống load_image_array.
+    """
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    if isinstance(image, Image.Image):
+        return image.size
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    pos = None if isinstance(image, (str, os.PathLike)) else image.tell()
+    with Image.open(image) as im:
+        size = im.size
+    if pos is not None:
+        image.seek(pos)
+    return size
+
+def required_pixels(payload_size: int, mode: str = "simple", pls_version: int = PLS_VERSION,
+                    depth: int | str = 1, **fields) -> int:
+    """
+    Số pixel encode_lsb cần cho payload_size byte (trước mã hóa):
+    payload đã mã hóa (AES-GCM) + header metadata (Advanced mode).
+    pls_version/fields: giống metadata sẽ ghi (encode_lsb_stream, raster dùng pls=2).
+    depth: số bit mỗi kênh (1-4) hoặc adaptive. Adaptive phụ thuộc nội dung ảnh nên trả về
+        cận trên (mỗi slot chứa ít nhất 1 bit); giá trị chính xác: capacity(image, depth="adaptive").
+    """
+    depth = check_depth(depth)
+    n_enc = aead_encrypted_size(payload_size)
+    bits_per_slot = 1 if depth == ADAPTIVE else depth
+    pixels = math.ceil(math.ceil(n_enc * 8 / bits_per_slot) / 3)
+    mode = mode.lower()
+    if depth != 1:
+        pls_version, fields = 2, {"depth": depth}
+    if mode == "advanced":
+        pixels += header_pixels_for(format_metadata(n_enc, pls=pls_version, **fields))
+    elif mode != "simple":
+        raise ValueError(f"Invalid mode: {mode}")
+    return pixels
+
+def payload_fits(width: int, height: int, payload_size: int, mode: str = "simple", **kwargs) -> bool:
+    """True nếu payload_size byte nhúng vừa ảnh width x height."""
+    return required_pixels(payload_size, mode, **kwargs) <= width * height
+
+def max_payload_size(width: int, height: int, mode: str = "simple", **kwargs) -> int:
+    """
+    Số byte payload lớn nhất nhúng được vào ảnh width x height (chính xác theo
+    header, overhead AES-GCM và mode). ValueError nếu ảnh không chứa nổi cả payload rỗng.
+    """
+    total_pixels = width * height
+    lo, hi = 0, total_pixels * 3 * max(DEPTHS) // 8
+    if required_pixels(0, mode, **kwargs) > total_pixels:
+        raise ValueError(f"Image too small: {width}x{height} cannot hold any payload in {mode} mode")
+    # required_pixels tăng theo payload_size -> tìm nhị phân
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if required_pixels(mid, mode, **kwargs) <= total_pixels:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def capacity(image, mode: str = "simple", depth: int | str = 1, **kwargs) -> int:
+    """
+    max_payload_size cho một ảnh (chỉ đọc header).
+    depth="adaptive": đọc pixel, capacity = tổng độ sâu texture của mọi slot ngoài header.
+    """
+    if check_depth(depth) != ADAPTIVE:
+        return max_payload_size(*image_size(image), mode, depth=depth, **kwargs)
     
-    # Tính tổng số bits cần đọc
-    total_bits = LENGTH_BITS + len_enc * 8
-    header_pixels = math.ceil(total_bits / 3)
+    pixels = load_image_array(image)
+    mode = mode.lower()
+    if mode not in ("simple", "advanced"):
+        raise ValueError(f"Invalid mode: {mode}")
+    bits_for = {}  # header_pixels -> số bit chứa được (texture phụ thuộc header)
     
-    # Đọc lại toàn bộ header
-    bitstream = ""
-    for px_idx in range(header_pixels):
-        row, col = divmod(px_idx, width)
-        r, g, b = pixels[col, row]
-        bitstream += str(r & 1) + str(g & 1) + str(b & 1)
+    def fits(payload_size):
+        n_enc = aead_encrypted_size(payload_size)
+        offset = 0
+        if mode == "advanced":
+            offset = header_pixels_for(format_metadata(n_enc, pls=2, depth=ADAPTIVE))
+        if offset not in bits_for:
+            depth_map = texture_depth_map(pixels, offset)
+            bits_for[offset] = 3 * int(depth_map[offset:].sum(dtype=np.int64))
+        return n_enc * 8 <= bits_for[offset]
     
-    # Parse encrypted metadata
-    encrypted_bytes = bytearray()
-    bit_pos = LENGTH_BITS
+    lo, hi = 0, pixels.shape[0] * pixels.shape[1] * 3 * max(DEPTHS) // 8
+    if not fits(0):
+        raise ValueError(f"Image too small: cannot hold any payload in {mode} mode")
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def embed_payload(pixels: np.ndarray, data: bytes, key: bytes | StegoKey, **fields) -> int:
+    """
+    Nhúng dữ liệu đã mã hóa sẵn (bằng subkey payload) theo kiểu Advanced mode:
+    metadata (kèm fields) ở header, data theo PLS v2 sinh từ key. pixels được sửa trực tiếp.
+    Trả về số pixel header.
+    """
+    key = as_stego_key(key)
+    height, width = pixels.shape[:2]
+    rng = np.random.default_rng()
+    offset = embed_metadata(pixels, format_metadata(len(data), pls=2, **fields), key, rng)
+    domain = width * height - offset
+    needed_bits = len(data) * 8
+    if math.ceil(needed_bits / 3) > domain:
+        raise ValueError(f"Not enough pixels: need {math.ceil(needed_bits / 3)}, available {domain}")
     
-    for _ in range(len_enc):
-        byte_bits = bitstream[bit_pos:bit_pos + 8]
-        if len(byte_bits) < 8:
-            raise ValueError("Incomplete metadata in header")
-        encrypted_bytes.append(int(byte_bits, 2))
-        bit_pos += 8
+    slots = pls_slots_v2(0, needed_bits, offset, domain, _feistel_round_keys(key.pls_key))
+    embed_bits(pixels.reshape(-1), slots, bytes_to_bits(data), rng)
+    return offset
+
+def extract_payload(pixels: np.ndarray, key: bytes | StegoKey) -> tuple[bytes, dict]:
+    """Ngược lại embed_payload: trả về (data đã mã hóa, fields trong metadata)."""
+    height, width = pixels.shape[:2]
+    flat = pixels.reshape(-1)
+    metadata, offset, key = read_metadata(lambda start, stop: flat[start:stop] & 1, len(flat), key)
+    n_bytes, fields = parse_metadata(metadata)
+    if int(fields.get("pls", 1)) != 2:
+        raise ValueError("Payload was not embedded with PLS v2")
     
-    # Giải mã
-    metadata = aes_decrypt(bytes(encrypted_bytes), key)
-    return metadata, header_pixels
+    slots = pls_slots_v2(0, n_bytes * 8, offset, width * height - offset, _feistel_round_keys(key.pls_key))
+    return bits_to_bytes(extract_bits(flat, slots)), fields
 
-def encode_lsb(image_path: str, message: str, stego_path: str, pls_enc_path: str, key: bytes, mode: str="simple"):
+def encode_lsb(image, message: str | bytes, stego_path, pls_enc_path, key: bytes | StegoKey, mode: str="simple",
+               pls_format: str = None, metrics=None, depth: int | str = 1, output_profile: str = None,
+               writer=None) -> tuple[np.ndarray, bytes | None]:
     """
-    Nhúng message vào ảnh.
+    Nhúng message (str hoặc bytes) vào ảnh.
+    
+    image: đường dẫn, bytes, BytesIO, ảnh PIL hoặc mảng NumPy (xem load_image_array)
+    stego_path, pls_enc_path: đường dẫn, file-like, hoặc None để không ghi ra đĩa
+    key: bytes hoặc StegoKey (dùng lại cho nhiều ảnh để không phải dẫn xuất subkey mỗi lần)
+    metrics: Instrumentation (tùy chọn) nhận thời gian từng giai đoạn và số đếm
+    Trả về (mảng ảnh stego (H, W, 3) uint8, file PLS đã mã hóa hoặc None).
     
     Simple mode: cần pls_enc_path để lưu PLS
+        pls_format="list" (mặc định với depth 1): file PLS chứa toàn bộ danh sách pixel
+        pls_format="seed": file PLS chỉ chứa seed ngẫu nhiên (vài chục byte)
     Advanced mode: pls_enc_path = None, PLS sinh từ key
+    
+    depth: số bit thấp dùng mỗi kênh (1-4) hoặc "adaptive" (1-4 theo texture từng block).
+        depth khác 1 dùng PLS v2, chọn ít pixel hơn; Simple mode khi đó chỉ lưu được file PLS
+        dạng seed (pls_format="list" -> ValueError). depth được ghi vào header / file PLS nên
+        decode_lsb không cần tham số thêm; encode_lsb_stream, raster_utils và shard_utils chỉ nhúng 1 bit.
+    output_profile: định dạng lossless của ảnh stego (writer_utils.PROFILES, vd "png-fast", "webp", "tiff")
+    writer: BackgroundWriter để ghi ảnh trên thread nền (không sửa mảng trả về cho tới khi ghi xong)
     """
-    im = Image.open(image_path)
-    if im.mode != "RGB": 
-        im = im.convert("RGB")
+    depth = check_depth(depth)
+    if pls_format is None:
+        pls_format = "list" if depth == 1 else "seed"
+    if pls_format not in PLS_FORMATS:
+        raise ValueError(f"Invalid PLS format: {pls_format}")
+    if depth != 1 and pls_format != "seed" and mode.lower() == "simple":
+        raise ValueError(f"PLS format {pls_format} requires depth 1 (depth {depth} stores a seed PLS)")
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
     
-    width, height = im.size
+    # Bản sao mảng pixel uint8 và view phẳng, mỗi pixel chiếm 3 slot R, G, B
+    with metrics.stage("load_image"):
+        pixels = np.array(load_image_array(image))
+    flat = pixels.reshape(-1)
+    
+    height, width = pixels.shape[:2]
     total_pixels = width * height
     
+    # RNG riêng cho lần encode này (±1 của LSB matching, PLS Simple mode)
+    rng = np.random.default_rng()
+    
     # Mã hóa message
-    encrypted_msg = aes_encrypt(message.encode(), key)
-    bitstream = "".join(format(b, "08b") for b in encrypted_msg)
-    needed_bits = len(bitstream)
+    with metrics.stage("encrypt"):
+        payload = message.encode() if isinstance(message, str) else bytes(message)
+        encrypted_msg = key.encrypt(payload, "payload", PAYLOAD_AAD)
+        bits = bytes_to_bits(encrypted_msg)
+    needed_bits = len(bits)
+    metrics.count("payload_bytes", len(payload))
+    metrics.count("encrypted_bytes", len(encrypted_msg))
+    metrics.count("bits", needed_bits)
     
     offset = 0
     mode = mode.lower()
     
-    if mode == "advanced":
+    if depth != 1:
+        # Nhiều bit mỗi kênh: PLS v2 (từ key hoặc seed riêng), metadata/file PLS ghi depth
+        if mode == "advanced":
+            with metrics.stage("metadata"):
+                metadata = format_metadata(len(encrypted_msg), pls=2, depth=depth)
+                offset = embed_metadata(pixels, metadata, key, rng)
+            round_keys = _feistel_round_keys(key.pls_key)
+        elif mode == "simple":
+            seed = int.from_bytes(os.urandom(8), "big")
+            round_keys = _feistel_round_keys(seed.to_bytes(8, "big"))
+        else:
+            raise ValueError(f"Invalid mode: {mode}")
+        
+        with metrics.stage("pls"):
+            slots, depths = deep_plan(pixels, offset, round_keys, needed_bits, depth)
+        metrics.count("pixels", len(np.unique(slots // 3)) + offset)
+        with metrics.stage("embed"):
+            embed_symbols(flat, slots, depths, bits, rng, keep_high=depth == ADAPTIVE)
+        
+    elif mode == "advanced":
         # Nhúng metadata vào header
-        metadata = f"advanced:{len(encrypted_msg)}".encode()
-        offset = embed_metadata(im, metadata, key)
-        print(f"[Advanced] Metadata embedded in {offset} pixels")
+        with metrics.stage("metadata"):
+            metadata = format_metadata(len(encrypted_msg), pls=PLS_VERSION)
+            offset = embed_metadata(pixels, metadata, key, rng)
+        logger.info("[Advanced] Metadata embedded in %d pixels", offset)
         
         # Sinh PLS từ key
-        pls = generate_pls_seeded(total_pixels, needed_bits, key, offset)
+        with metrics.stage("pls"):
+            pls = generate_pls_seeded(total_pixels, needed_bits, key, offset)
         
     elif mode == "simple":
         # PLS ngẫu nhiên
-        pls = generate_pls(total_pixels, needed_bits)
+        with metrics.stage("pls"):
+            if pls_format == "seed":
+                seed = int.from_bytes(os.urandom(8), "big")
+                pls = generate_pls_from_seed(total_pixels, needed_bits, seed)
+            else:
+                pls = generate_pls(total_pixels, needed_bits, rng=random.Random())
         
     else:
         raise ValueError(f"Invalid mode: {mode}")
     
-    # Nhúng message vào ảnh
-    pixels = im.load()
-    
-    for i, bit in enumerate(bitstream):
-        px_idx = pls[i]
-        row, col = divmod(px_idx, width)
-        r, g, b = pixels[col, row]
-        
-        ch = i % 3
-        bval = int(bit)
-        
-        if ch == 0:
-            r = lsb_match(r, bval)
-        elif ch == 1:
-            g = lsb_match(g, bval)
-        else:
-            b = lsb_match(b, bval)
-        
-        pixels[col, row] = (r, g, b)
+    if depth == 1:
+        metrics.count("pixels", math.ceil(needed_bits / 3) + offset)
+        # Nhúng message vào ảnh (một lần trên toàn bộ slot)
+        with metrics.stage("embed"):
+            embed_bits(flat, pls_slots(pls), bits, rng)
     
     # Lưu ảnh
-    im.save(stego_path)
-    print(f"[{mode.upper()}] Stego image saved: {stego_path}")
+    if stego_path is not None:
+        _save_stego(pixels, stego_path, output_profile, writer, metrics)
+        logger.info("[%s] Stego image saved: %s", mode.upper(), stego_path)
     
-    # Simple mode: lưu PLS
-    if mode == "simple" and pls_enc_path:
-        pls_bytes = ",".join(map(str, pls)).encode()
-        enc_pls = aes_encrypt(pls_bytes, key)
-        with open(pls_enc_path, "wb") as f: 
-            f.write(enc_pls)
-        print(f"[SIMPLE] PLS saved: {pls_enc_path}")
+    # Simple mode: mã hóa và lưu PLS
+    enc_pls = None
+    if mode == "simple":
+        with metrics.stage("pls_save"):
+            if depth != 1:
+                pls_data = pack_pls_seed(seed, needed_bits, version=2, depth=depth)
+            elif pls_format == "seed":
+                pls_data = pack_pls_seed(seed, needed_bits)
+            else:
+                pls_data = pack_pls(pls)
+            enc_pls = key.encrypt(pls_data, "pls", PLS_AAD)
+            if isinstance(pls_enc_path, (str, os.PathLike)):
+                with open(pls_enc_path, "wb") as f: 
+                    f.write(enc_pls)
+                logger.info("[SIMPLE] PLS saved: %s", pls_enc_path)
+            elif pls_enc_path is not None:
+                pls_enc_path.write(enc_pls)
+        metrics.count("pls_bytes", len(enc_pls))
+    
+    return pixels, enc_pls
 
-def decode_lsb(stego_path: str, pls_enc_path: str, key: bytes) -> str:
+def decode_lsb(stego, pls_enc_path, key: bytes | StegoKey, metrics=None, as_bytes: bool = False) -> str | bytes:
     """
     Trích xuất message từ ảnh stego.
     
-    Simple mode: cần pls_enc_path
+    stego: đường dẫn, bytes, BytesIO, ảnh PIL hoặc mảng NumPy
+    Simple mode: cần pls_enc_path (đường dẫn, bytes hoặc file-like)
     Advanced mode: pls_enc_path = None
+    key: bytes hoặc StegoKey
+    metrics: Instrumentation (tùy chọn) nhận thời gian từng giai đoạn và số đếm
+    as_bytes: trả về payload dạng bytes (payload nhị phân) thay vì giải mã UTF-8
     """
-    im = Image.open(stego_path)
-    if im.mode != "RGB": 
-        im = im.convert("RGB")
-    
-    width, height = im.size
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
+    with metrics.stage("load_image"):
+        pixels = load_image_array(stego)
+    height, width = pixels.shape[:2]
     total_pixels = width * height
     
-    if not pls_enc_path:
+    if pls_enc_path is None or (isinstance(pls_enc_path, str) and not pls_enc_path):
         # Advanced mode: đọc metadata từ header
-        metadata, header_pixels = extract_metadata(im, key)
-        metadata_str = metadata.decode(errors="ignore")
-        
-        if not metadata_str.startswith("advanced:"):
-            raise ValueError(f"Invalid metadata format: {metadata_str}")
-        
-        n_bytes = int(metadata_str.split(":")[1])
-        print(f"[Advanced] Metadata: {n_bytes} bytes, header: {header_pixels} pixels")
+        with metrics.stage("metadata"):
+            flat = pixels.reshape(-1)
+            metadata, header_pixels, key = read_metadata(lambda start, stop: flat[start:stop] & 1, len(flat), key)
+            n_bytes, fields = parse_metadata(metadata)
+        pls_version = int(fields.get("pls", 1))
+        depth = check_depth(fields.get("depth", 1))
+        n_bits = n_bytes * 8
+        logger.info("[Advanced] Metadata: %d bytes, header: %d pixels, PLS v%d", n_bytes, header_pixels, pls_version)
         
         # Sinh lại PLS từ key
-        pls = generate_pls_seeded(total_pixels, n_bytes * 8, key, header_pixels)
+        with metrics.stage("pls"):
+            if depth != 1:
+                slots, depths = deep_plan(pixels, header_pixels, _feistel_round_keys(key.pls_key), n_bits, depth)
+            else:
+                pls = generate_pls_seeded(total_pixels, n_bits, key, header_pixels, version=pls_version)
         
     else:
         # Simple mode: đọc PLS từ file
-        with open(pls_enc_path, "rb") as f: 
-            encrypted_data = f.read()
-        decrypted_data = aes_decrypt(encrypted_data, key)
-        pls = list(map(int, decrypted_data.decode().split(",")))
-        print(f"[Simple] PLS loaded: {len(pls)} bits")
-    
-    # Trích xuất bits
-    pixels = im.load()
-    bitstream = ""
-    
-    for i, px_idx in enumerate(pls):
-        row, col = divmod(px_idx, width)
-        r, g, b = pixels[col, row]
-        
-        ch = i % 3
-        if ch == 0: 
-            bitstream += str(r & 1)
-        elif ch == 1: 
-            bitstream += str(g & 1)
-        else: 
-            bitstream += str(b & 1)
-    
-    # Parse bytes
-    encrypted_bytes = bytearray()
-    for i in range(0, len(bitstream), 8):
-        byte_bits = bitstream[i:i+8]
-        if len(byte_bits) < 8: 
-            break
-        encrypted_bytes.append(int(byte_bits, 2))
+        with metrics.stage("pls"):
+            encrypted_data = _read_pls_data(pls_enc_path)
+            decrypted_data, key = key.decrypt(encrypted_data, "pls", PLS_AAD)
+            depth = pls_depth(decrypted_data)
+            if depth != 1:
+                _, _, seed, n_bits = _PLS_SEED_HEADER.unpack_from(decrypted_data)
+                slots, depths = deep_plan(pixels, 0, _feistel_round_keys(seed.to_bytes(8, "big")), n_bits, depth)
+            else:
+                pls = unpack_pls(decrypted_data, total_pixels)
+                n_bits = len(pls)
+        metrics.count("pls_bytes", len(encrypted_data))
+        logger.info("[Simple] PLS loaded: %d bits", n_bits)
+    metrics.count("bits", n_bits)
+    
+    # Trích xuất bits và gom thành bytes
+    with metrics.stage("extract"):
+        if depth != 1:
+            bits = extract_symbols(pixels.reshape(-1), slots, depths, n_bits)
+        else:
+            bits = extract_bits(pixels.reshape(-1), pls_slots(pls))
+        encrypted_bytes = bits_to_bytes(bits)
+    metrics.count("encrypted_bytes", len(encrypted_bytes))
     
     # Giải mã
-    return aes_decrypt(bytes(encrypted_bytes), key).decode()
\ No newline at end of file
+    with metrics.stage("decrypt"):
+        payload = decrypt_any(encrypted_bytes, key.payload_key, PAYLOAD_AAD)
+    metrics.count("payload_bytes", len(payload))
+    return payload if as_bytes else payload.decode()
+
+# ===== Cập nhật payload trên ảnh stego có sẵn =====
+def plan_update(read_lsb, n_slots: int, key: StegoKey, payload: bytes) -> tuple[np.ndarray | None, int, bytes, dict]:
+    """
+    Chuẩn bị thay payload của ảnh Advanced mode: đọc header cũ, mã hóa payload mới.
+    Metadata mới giữ phiên bản PLS và depth cũ; header cũ được giữ nguyên nếu metadata
+    không đổi (cùng độ dài payload) và đã mã hóa bằng subkey (không phải định dạng cũ).
+    Trả về (bit header mới hoặc None, số pixel header, payload đã mã hóa, fields).
+    """
+    old_metadata, old_header_pixels, used_key = read_metadata(read_lsb, n_slots, key)
+    _, old_fields = parse_metadata(old_metadata)
+    extra = set(old_fields) - {"pls", "depth"}
+    if extra:
+        raise ValueError(f"Cannot update image with metadata fields: {', '.join(sorted(extra))}")
+    
+    fields = {}
+    if "pls" in old_fields:
+        fields["pls"] = int(old_fields["pls"])
+        if fields["pls"] not in SUPPORTED_PLS_VERSIONS:
+            raise ValueError(f"Unsupported PLS version: {fields['pls']}")
+    depth = check_depth(old_fields.get("depth", 1))
+    if depth != 1:
+        fields["depth"] = depth
+    encrypted = key.encrypt(payload, "payload", PAYLOAD_AAD)
+    metadata = format_metadata(len(encrypted), **fields)
+    if metadata == old_metadata and used_key is key:
+        return None, old_header_pixels, encrypted, fields
+    header = metadata_bits(metadata, key)
+    return header, math.ceil(len(header) / 3), encrypted, fields
+
+def update_lsb(stego, message: str | bytes, stego_path, key: bytes | StegoKey, metrics=None,
+               output_profile: str = None, writer=None) -> tuple[np.ndarray, int]:
+    """
+    Thay message trong ảnh stego Advanced mode có sẵn, không cần ảnh cover.
+    PLS được sinh lại từ key (cùng phiên bản PLS với ảnh cũ); chỉ các slot có bit khác
+    bit mới bị sửa (LSB matching), header giữ nguyên khi độ dài payload không đổi
+    (trừ ảnh định dạng key cũ: header được ghi lại bằng subkey).
+    Lưu ý: payload mã hóa lại với nonce mới nên khoảng một nửa số bit payload vẫn đổi.
+    
+    stego: giống decode_lsb; stego_path: nơi ghi kết quả (có thể trùng file cũ) hoặc None
+    Trả về (mảng ảnh stego mới, số pixel bị đổi).
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
+    with metrics.stage("load_image"):
+        pixels = np.array(load_image_array(stego))
+    flat = pixels.reshape(-1)
+    total_pixels = pixels.shape[0] * pixels.shape[1]
+    payload = message.encode() if isinstance(message, str) else bytes(message)
+    
+    with metrics.stage("metadata"):
+        header, offset, encrypted, fields = plan_update(lambda start, stop: flat[start:stop] & 1, len(flat),
+                                                        key, payload)
+    if offset > total_pixels:
+        raise ValueError(f"Image too small: need {offset} pixels for metadata")
+    needed_bits = len(encrypted) * 8
+    metrics.count("payload_bytes", len(payload))
+    metrics.count("bits", needed_bits)
+    
+    rng = np.random.default_rng()
+    changed = []
+    if header is not None:
+        changed.append(embed_bits(flat, np.arange(len(header)), header, rng))
+    
+    depth = fields.get("depth", 1)
+    round_keys = _feistel_round_keys(key.pls_key)
+    bits = bytes_to_bits(encrypted)
+    with metrics.stage("embed"):
+        if depth != 1:
+            slots, depths = deep_plan(pixels, offset, round_keys, needed_bits, depth)
+            changed.append(embed_symbols(flat, slots, depths, bits, rng, keep_high=depth == ADAPTIVE))
+        elif fields.get("pls", 1) == 2:
+            domain = total_pixels - offset
+            if math.ceil(needed_bits / 3) > domain:
+                raise ValueError(f"Not enough pixels: need {math.ceil(needed_bits / 3)}, available {domain}")
+            changed.append(embed_bits(flat, pls_slots_v2(0, needed_bits, offset, domain, round_keys), bits, rng))
+        else:
+            slots = pls_slots(generate_pls_seeded(total_pixels, needed_bits, key, offset, version=1))
+            changed.append(embed_bits(flat, slots, bits, rng))
+    changed_pixels = len(np.unique(np.concatenate(changed) // 3))
+    metrics.count("changed_pixels", changed_pixels)
+    logger.info("[Update] %d pixels changed (header %s)", changed_pixels, "kept" if header is None else "rewritten")
+    
+    if stego_path is not None:
+        _save_stego(pixels, stego_path, output_profile, writer, metrics)
+    return pixels, changed_pixels
+
+# ===== Thử nhiều key trên một ảnh =====
+TRIAL_CHUNK_KEYS = 256
+
+def _match_keys(keys: list[bytes], encrypted: bytes, role: str, aad: bytes, start: int = 0) -> list[int]:
+    """Chỉ số (cộng start) các key giải mã được encrypted; header còn phải parse được metadata."""
+    matches = []
+    for i, raw in enumerate(keys):
+        try:
+            data, _ = StegoKey(raw).decrypt(encrypted, role, aad)
+            if role == "header":
+                parse_metadata(data)
+        except ValueError:
+            continue
+        matches.append(start + i)
+    return matches
+
+def trial_decode(stego, keys, pls_enc_path=None, workers: int = 1, decode: bool = True,
+                 metrics=None, as_bytes: bool = False) -> list[tuple[int, str | bytes | None]]:
+    """
+    Tìm key (trong keys) của một ảnh stego mà không phải decode_lsb với từng key.
+    Ảnh chỉ đọc một lần; header là các slot đầu nên LSB của chúng được đóng gói (packbits)
+    một lần thành đúng bytes header. Mỗi key chỉ phải giải mã header (Advanced mode)
+    hoặc file PLS (Simple mode, truyền pls_enc_path); AES-GCM từ chối key sai ngay.
+    
+    workers > 1: chia keys cho nhiều process.
+    decode=True: giải mã message với các key khớp (loại key khớp nhầm với định dạng CBC cũ).
+    as_bytes: message dạng bytes như decode_lsb (payload nhị phân).
+    Trả về [(chỉ số key trong keys, message hoặc None)].
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    raw_keys = [key.raw if isinstance(key, StegoKey) else bytes(key) for key in keys]
+    with metrics.stage("load_image"):
+        pixels = load_image_array(stego)
+    flat = pixels.reshape(-1)
+    
+    with metrics.stage("header"):
+        if pls_enc_path is None:
+            role, aad = "header", HEADER_AAD
+            len_enc = int.from_bytes(np.packbits(flat[:LENGTH_BITS] & 1).tobytes(), "big")
+            total_bits = LENGTH_BITS + len_enc * 8
+            if total_bits > len(flat):
+                raise ValueError("Incomplete metadata in header")
+            encrypted = np.packbits(flat[LENGTH_BITS:total_bits] & 1).tobytes()
+        else:
+            role, aad = "pls", PLS_AAD
+            encrypted = _read_pls_data(pls_enc_path)
+    
+    with metrics.stage("check"):
+        chunks = [(raw_keys[i:i + TRIAL_CHUNK_KEYS], i) for i in range(0, len(raw_keys), TRIAL_CHUNK_KEYS)]
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_match_keys, chunk, encrypted, role, aad, start) for chunk, start in chunks]
+                candidates = [i for future in futures for i in future.result()]
+        else:
+            candidates = [i for chunk, start in chunks for i in _match_keys(chunk, encrypted, role, aad, start)]
+    metrics.count("keys", len(raw_keys))
+    metrics.count("candidates", len(candidates))
+    if not decode:
+        return [(i, None) for i in candidates]
+    
+    matches = []
+    with metrics.stage("decode"):
+        for i in candidates:
+            try:
+                # File PLS đã đọc ở trên (file-like không đọc lại được)
+                sidecar = None if pls_enc_path is None else encrypted
+                matches.append((i, decode_lsb(pixels, sidecar, raw_keys[i], as_bytes=as_bytes)))
+            except ValueError:
+                continue
+    return matches
+
+# ===== Streaming (payload lớn, bộ nhớ giới hạn) =====
+def _iter_source(source, chunk_size: int, payload_size: int | None):
+    """
+    Chuẩn hóa nguồn payload thành (iterator các chunk bytes, kích thước).
+    source: đường dẫn file, bytes, file-like hoặc iterator bytes (cần payload_size).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        size = os.path.getsize(source)
+        def chunks():
+            with open(source, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+        return chunks(), size
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source).cast("B")
+        return (bytes(view[i:i + chunk_size]) for i in range(0, len(view), chunk_size)), len(view)
+    if hasattr(source, "read"):
+        if payload_size is None:
+            pos = source.tell()
+            payload_size = source.seek(0, os.SEEK_END) - pos
+            source.seek(pos)
+        return iter(lambda: source.read(chunk_size), b""), payload_size
+    if payload_size is None:
+        raise ValueError("payload_size is required for iterator sources")
+    return (chunk.encode() if isinstance(chunk, str) else bytes(chunk) for chunk in source), payload_size
+
+def encode_lsb_stream(image, source, stego_path, pls_enc_path, key: bytes | StegoKey, mode: str = "advanced",
+                      payload_size: int = None, chunk_size: int = STREAM_CHUNK_SIZE,
+                      metrics=None, output_profile: str = None, writer=None) -> tuple[np.ndarray, bytes | None]:
+    """
+    Nhúng payload lớn (nhị phân) theo từng chunk với bộ nhớ không phụ thuộc kích thước payload.
+    Payload được đọc, mã hóa AES và ghi vào ảnh từng chunk; PLS dùng phiên bản 2
+    (hoán vị có khóa) nên vị trí của mỗi chunk được tính riêng, không cần sinh cả PLS.
+    
+    source: đường dẫn file, bytes, file-like hoặc iterator bytes (khi đó cần payload_size)
+    Simple mode: file PLS chỉ chứa seed (giống pls_format="seed")
+    Advanced mode: pls_enc_path = None, metadata ghi pls=2
+    Trả về (mảng ảnh stego, file PLS đã mã hóa hoặc None), giống encode_lsb.
+    output_profile, writer: giống encode_lsb.
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    key = as_stego_key(key)
+    with metrics.stage("load_image"):
+        pixels = np.array(load_image_array(image))
+    flat = pixels.reshape(-1)
+    height, width = pixels.shape[:2]
+    total_pixels = width * height
+    
+    chunks, payload_size = _iter_source(source, chunk_size, payload_size)
+    n_enc = aead_encrypted_size(payload_size)
+    needed_bits = n_enc * 8
+    
+    rng = np.random.default_rng()
+    mode = mode.lower()
+    if mode == "advanced":
+        with metrics.stage("metadata"):
+            offset = embed_metadata(pixels, format_metadata(n_enc, pls=2), key, rng)
+        round_keys = _feistel_round_keys(key.pls_key)
+        logger.info("[Advanced] Metadata embedded in %d pixels", offset)
+    elif mode == "simple":
+        offset = 0
+        seed = int.from_bytes(os.urandom(8), "big")
+        round_keys = _feistel_round_keys(seed.to_bytes(8, "big"))
+    else:
+        raise ValueError(f"Invalid mode: {mode}")
+    
+    domain = total_pixels - offset
+    needed_pixels = math.ceil(needed_bits / 3)
+    if needed_pixels > domain:
+        raise ValueError(f"Not enough pixels: need {needed_pixels}, available {domain}")
+    
+    # Mã hóa và nhúng từng chunk
+    bit_pos = 0
+    with metrics.stage("embed"):
+        for encrypted in aead_encrypt_stream(chunks, key.payload_key, PAYLOAD_AAD):
+            bits = bytes_to_bits(encrypted)
+            if bit_pos + len(bits) > needed_bits:
+                raise ValueError(f"Payload larger than payload_size ({payload_size} bytes)")
+            embed_bits(flat, pls_slots_v2(bit_pos, bit_pos + len(bits), offset, domain, round_keys), bits, rng)
+            bit_pos += len(bits)
+    metrics.count("payload_bytes", payload_size)
+    metrics.count("bits", bit_pos)
+    
+    if bit_pos != needed_bits:
+        raise ValueError(f"Payload smaller than payload_size ({payload_size} bytes)")
+    
+    if stego_path is not None:
+        _save_stego(pixels, stego_path, output_profile, writer, metrics)
+        logger.info("[%s] Stego image saved: %s", mode.upper(), stego_path)
+    
+    enc_pls = None
+    if mode == "simple":
+        enc_pls = key.encrypt(pack_pls_seed(seed, needed_bits, version=2), "pls", PLS_AAD)
+        if isinstance(pls_enc_path, (str, os.PathLike)):
+            with open(pls_enc_path, "wb") as f:
+                f.write(enc_pls)
+            logger.info("[SIMPLE] PLS saved: %s", pls_enc_path)
+        elif pls_enc_path is not None:
+            pls_enc_path.write(enc_pls)
+    
+    return pixels, enc_pls
+
+def pls_slot_source(total_pixels: int, pls_enc_path, key: bytes | StegoKey, read_lsb):
+    """
+    Chuẩn bị đọc payload theo từng đoạn: trả về (n_bits, slots_for, key) với
+    slots_for(start, stop) là slot của các bit [start, stop) và key là StegoKey
+    đã mở được header/file PLS (dùng để giải mã payload).
+    PLS v2 (metadata pls=2 hoặc seed sidecar v2) được tính theo đoạn; PLS v1 và
+    sidecar dạng danh sách cần sinh/đọc toàn bộ PLS trước.
+    read_lsb(start, stop): LSB của các slot đầu ảnh, dùng để đọc header Advanced mode.
+    """
+    if pls_enc_path is None or (isinstance(pls_enc_path, str) and not pls_enc_path):
+        metadata, header_pixels, key = read_metadata(read_lsb, total_pixels * 3, key)
+        n_bytes, fields = parse_metadata(metadata)
+        if check_depth(fields.get("depth", 1)) != 1:
+            raise ValueError("Images embedded with depth > 1 must be decoded with decode_lsb")
+        n_bits = n_bytes * 8
+        if int(fields.get("pls", 1)) == 2:
+            round_keys = _feistel_round_keys(key.pls_key)
+            def slots_for(start, stop):
+                return pls_slots_v2(start, stop, header_pixels, total_pixels - header_pixels, round_keys)
+        else:
+            all_slots = pls_slots(generate_pls_seeded(total_pixels, n_bits, key, header_pixels))
+            def slots_for(start, stop):
+                return all_slots[start:stop]
+    else:
+        pls_data, key = as_stego_key(key).decrypt(_read_pls_data(pls_enc_path), "pls", PLS_AAD)
+        if pls_depth(pls_data) != 1:
+            raise ValueError("Images embedded with depth > 1 must be decoded with decode_lsb")
+        if pls_data.startswith(PLS_SEED_MAGIC) and _PLS_SEED_HEADER.unpack_from(pls_data)[1] == 2:
+            _, _, seed, n_bits = _PLS_SEED_HEADER.unpack_from(pls_data)
+            round_keys = _feistel_round_keys(seed.to_bytes(8, "big"))
+            def slots_for(start, stop):
+                return pls_slots_v2(start, stop, 0, total_pixels, round_keys)
+        else:
+            all_slots = pls_slots(unpack_pls(pls_data, total_pixels))
+            n_bits = len(all_slots)
+            def slots_for(start, stop):
+                return all_slots[start:stop]
+    return n_bits, slots_for, key
+
+def decode_lsb_stream(stego, pls_enc_path, key: bytes | StegoKey, sink, chunk_size: int = STREAM_CHUNK_SIZE,
+                      metrics=None) -> int:
+    """
+    Trích xuất payload theo từng chunk và ghi ra sink (đường dẫn hoặc file-like).
+    Ảnh PLS v2 (encode_lsb_stream) được đọc từng đoạn; ảnh PLS v1 vẫn được hỗ trợ
+    nhưng cần sinh toàn bộ PLS trước. Trả về số byte đã ghi.
+    """
+    metrics = metrics or NULL_INSTRUMENTATION
+    with metrics.stage("load_image"):
+        pixels = load_image_array(stego)
+    flat = pixels.reshape(-1)
+    height, width = pixels.shape[:2]
+    total_pixels = width * height
+    
+    n_bits, slots_for, key = pls_slot_source(total_pixels, pls_enc_path, key,
+                                             lambda start, stop: flat[start:stop] & 1)
+    
+    n_bits -= n_bits % 8
+    step = chunk_size * 8
+    encrypted_chunks = (bits_to_bytes(extract_bits(flat, slots_for(start, min(start + step, n_bits))))
+                        for start in range(0, n_bits, step))
+    
+    written = 0
+    out = open(sink, "wb") if isinstance(sink, (str, os.PathLike)) else sink
+    try:
+        with metrics.stage("extract"):
+            for plain in decrypt_stream_any(encrypted_chunks, key.payload_key, PAYLOAD_AAD):
+                out.write(plain)
+                written += len(plain)
+    finally:
+        if out is not sink:
+            out.close()
+    metrics.count("bits", n_bits)
+    metrics.count("payload_bytes", written)
+    return written
+
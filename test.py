@@ -1,27 +1,22 @@
 import os
 import time
+import logging
 from PIL import Image
 import numpy as np
 import matplotlib.pyplot as plt
 from crypto_utils import generate_aes_key
 from stego_utils import encode_lsb, decode_lsb
+from metrics_utils import compare_images
 import tempfile
 import shutil
 
-# Tính MSE/PSNR
-def calc_metrics(original_path, stego_path):
-    orig = np.array(Image.open(original_path).convert("RGB"), dtype=np.float64)
-    stego = np.array(Image.open(stego_path).convert("RGB"), dtype=np.float64)
-    mse = np.mean((orig - stego) ** 2)
-    psnr = float("inf") if mse == 0 else 20 * np.log10(255.0 / np.sqrt(mse))
-    return mse, psnr
+# Tính MSE/PSNR từ kết quả compare_images (tính một lần mỗi mode, dùng chung cho histogram)
+def calc_metrics(metrics):
+    return metrics["mse"], metrics["psnr"]
 
-def plot_hist_mode(orig_file, stego_file, mode_name, output_path):
-    orig_gray = np.array(Image.open(orig_file).convert("L"))
-    stego_gray = np.array(Image.open(stego_file).convert("L"))
-
-    orig_hist, _ = np.histogram(orig_gray.flatten(), bins=256, range=(0,255))   
-    stego_hist, _ = np.histogram(stego_gray.flatten(), bins=256, range=(0,255))
+def plot_hist_mode(metrics, mode_name, output_path):
+    orig_hist = metrics["gray_hist_orig"]
+    stego_hist = metrics["gray_hist_stego"]
 
     x = np.arange(256)
     fig, ax = plt.subplots(figsize=(10,5))
@@ -48,6 +43,7 @@ def run_comparison(orig_file, message):
 
         modes = ["simple", "advanced"]
         stego_paths = []
+        mode_metrics = []
         metrics_text = ""
 
         for mode in modes:
@@ -65,8 +61,10 @@ def run_comparison(orig_file, message):
             decoded = decode_lsb(tmp_stego_path, tmp_pls_path, key)
             dec_time = time.time() - start
 
-            # Metrics
-            mse, psnr = calc_metrics(tmp_img_path, tmp_stego_path)
+            # Metrics (MSE/PSNR và histogram trong một lượt)
+            metrics = compare_images(tmp_img_path, tmp_stego_path)
+            mse, psnr = calc_metrics(metrics)
+            mode_metrics.append(metrics)
 
             stego_paths.append(tmp_stego_path)
 
@@ -90,16 +88,14 @@ def run_comparison(orig_file, message):
             f.write(metrics_text)
 
         # Plot histograms
-        for mode, stego_path in zip(modes, stego_paths):
-            plot_hist_mode(tmp_img_path, stego_path, mode, f"output/histogram_{mode}.png")
+        for mode, metrics in zip(modes, mode_metrics):
+            plot_hist_mode(metrics, mode, f"output/histogram_{mode}.png")
 
         # Combined histogram
-        orig_gray = np.array(Image.open(tmp_img_path).convert("L"))
-        hist_data = {"Original": np.histogram(orig_gray.flatten(), bins=256, range=(0,255))[0]}
+        hist_data = {"Original": mode_metrics[0]["gray_hist_orig"]}
 
-        for mode, stego_path in zip(modes, stego_paths):
-            stego_gray = np.array(Image.open(stego_path).convert("L"))
-            hist_data[mode.capitalize()] = np.histogram(stego_gray.flatten(), bins=256, range=(0,255))[0]
+        for mode, metrics in zip(modes, mode_metrics):
+            hist_data[mode.capitalize()] = metrics["gray_hist_stego"]
 
         x = np.arange(256)
         fig, ax = plt.subplots(figsize=(12,5))
@@ -126,12 +122,14 @@ def run_comparison(orig_file, message):
             os.unlink(path)
 
     except Exception as e:
-        pass
+        print(f"❌ Lỗi khi chạy so sánh: {type(e).__name__}: {e}")
+        raise
 
     # Print thông báo hoàn tất
     print("So sánh hoàn tất. Kiểm tra thư mục output/")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     orig_file = "image/cameraman.png"  # Replace with your image path
     message = ("This is a secret message. Only those with the key can read it.")    # Replace with your test message
     run_comparison(orig_file, message)
\ No newline at end of file
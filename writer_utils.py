@@ -0,0 +1,158 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from instrumentation import NULL_INSTRUMENTATION
+
+logger = logging.getLogger(__name__)
+
+# Profile ghi ảnh stego (đều lossless): tên -> (format PIL, tham số save)
+# "png" giữ nguyên mặc định cũ của PIL (zlib level 6)
+PROFILES = {
+    "png": ("PNG", {}),
+    "png-fast": ("PNG", {"compress_level": 1}),
+    "png-store": ("PNG", {"compress_level": 0}),
+    "png-small": ("PNG", {"compress_level": 9, "optimize": True}),
+    "webp": ("WEBP", {"lossless": True, "exact": True, "quality": 50, "method": 4}),
+    "webp-fast": ("WEBP", {"lossless": True, "exact": True, "quality": 0, "method": 0}),
+    "webp-small": ("WEBP", {"lossless": True, "exact": True, "quality": 90, "method": 6}),
+    "tiff": ("TIFF", {}),
+    "tiff-deflate": ("TIFF", {"compression": "tiff_adobe_deflate"}),
+    "tiff-lzw": ("TIFF", {"compression": "tiff_lzw"}),
+    "ppm": ("PPM", {}),
+    "bmp": ("BMP", {}),
+    "tga": ("TGA", {}),
+}
+DEFAULT_PROFILE = "png"
+
+# Đuôi file -> profile mặc định khi không chỉ định profile
+EXTENSION_PROFILES = {
+    ".png": "png",
+    ".webp": "webp",
+    ".tif": "tiff",
+    ".tiff": "tiff",
+    ".ppm": "ppm",
+    ".pnm": "ppm",
+    ".bmp": "bmp",
+    ".tga": "tga",
+}
+
+PPM_CHUNK_ROWS = 256
+
+def profile_for(target, profile: str = None) -> str:
+    """
+    Chọn profile: theo tham số, theo đuôi file (PNG nếu không có đuôi hoặc là file-like).
+    Đuôi file không có profile lossless (vd .jpg) -> ValueError.
+    """
+    if profile is None:
+        ext = os.path.splitext(os.fspath(target))[1].lower() if isinstance(target, (str, os.PathLike)) else ""
+        if ext and ext not in EXTENSION_PROFILES:
+            raise ValueError(f"No lossless output profile for extension {ext} "
+                             f"(expected one of {', '.join(EXTENSION_PROFILES)})")
+        profile = EXTENSION_PROFILES.get(ext, DEFAULT_PROFILE)
+    if profile not in PROFILES:
+        raise ValueError(f"Invalid output profile: {profile} (expected one of {', '.join(PROFILES)})")
+    return profile
+
+def _write_ppm(pixels: np.ndarray, f):
+    """Ghi PPM (P6) trực tiếp từ mảng pixel theo từng khối dòng, không qua PIL."""
+    height, width = pixels.shape[:2]
+    f.write(b"P6\n%d %d\n255\n" % (width, height))
+    for row in range(0, height, PPM_CHUNK_ROWS):
+        f.write(np.ascontiguousarray(pixels[row:row + PPM_CHUNK_ROWS]).data)
+
+def _write(pixels: np.ndarray, f, profile: str):
+    fmt, params = PROFILES[profile]
+    if fmt == "PPM":
+        _write_ppm(pixels, f)
+    else:
+        Image.fromarray(pixels, "RGB").save(f, format=fmt, **params)
+
+def write_image(pixels: np.ndarray, target, profile: str = None, metrics=None) -> int:
+    """
+    Ghi mảng pixel (H, W, 3) uint8 ra đường dẫn hoặc file-like theo profile lossless.
+    Trả về số byte đã ghi; metrics nhận stage "save" và count "bytes_written".
+    """
+    profile = profile_for(target, profile)
+    metrics = metrics or NULL_INSTRUMENTATION
+    with metrics.stage("save"):
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                _write(pixels, f, profile)
+                n_bytes = f.seek(0, io.SEEK_END)
+        else:
+            # TIFF ghi lùi lại để sửa offset -> đo theo cuối stream
+            start = target.tell()
+            _write(pixels, target, profile)
+            n_bytes = target.seek(0, io.SEEK_END) - start
+    metrics.count("bytes_written", n_bytes)
+    return n_bytes
+
+class BackgroundWriter:
+    """
+    Ghi ảnh stego trên thread nền để encode ảnh tiếp theo không phải chờ nén.
+    zlib/libwebp nhả GIL nên nhiều ảnh được nén song song.
+    Không sửa mảng pixel đã submit cho tới khi ghi xong (close() hoặc future.result()).
+
+    results: danh sách {"target", "profile", "seconds", "bytes"} của các ảnh đã ghi.
+    """
+
+    def __init__(self, max_workers: int = None, profile: str = None):
+        self.profile = profile
+        self.results = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stego-writer")
+        self._futures = []
+
+    def _job(self, pixels, target, profile):
+        start = time.perf_counter()
+        n_bytes = write_image(pixels, target, profile)
+        record = {"target": os.fspath(target) if isinstance(target, (str, os.PathLike)) else None,
+                  "profile": profile, "seconds": time.perf_counter() - start, "bytes": n_bytes}
+        self.results.append(record)
+        logger.info("Stego image written: %s (%s, %d bytes, %.3fs)", record["target"], profile,
+                    n_bytes, record["seconds"])
+        return n_bytes
+
+    def submit(self, pixels: np.ndarray, target, profile: str = None):
+        """Đưa một ảnh vào hàng đợi ghi; trả về Future (số byte đã ghi)."""
+        profile = profile_for(target, profile or self.profile)
+        future = self._executor.submit(self._job, pixels, target, profile)
+        self._futures.append(future)
+        return future
+
+    def close(self):
+        """Chờ ghi xong mọi ảnh; ném lại lỗi ghi đầu tiên nếu có."""
+        self._executor.shutdown(wait=True)
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compare_profiles(pixels: np.ndarray, profiles: list[str] = None, repeat: int = 1) -> dict:
+    """
+    Đo thời gian ghi (lần nhanh nhất) và số byte của từng profile (ghi vào bộ nhớ),
+    kiểm tra đọc lại đúng từng pixel. Trả về {profile: {"seconds", "bytes", "mb_per_s"}}.
+    """
+    results = {}
+    for profile in profiles or PROFILES:
+        best = float("inf")
+        for _ in range(repeat):
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            n_bytes = write_image(pixels, buffer, profile)
+            best = min(best, time.perf_counter() - start)
+        buffer.seek(0)
+        with Image.open(buffer) as im:
+            if not np.array_equal(np.asarray(im.convert("RGB")), pixels):
+                raise ValueError(f"Output profile {profile} is not lossless")
+        results[profile] = {"seconds": best, "bytes": n_bytes,
+                            "mb_per_s": pixels.nbytes / best / 1e6 if best > 0 else None}
+    return results